@@ -0,0 +1,93 @@
+"""
+Benchmark of SMEAR met data fetching against a local stand-in server.
+
+Fetches the campaign (April-November 2016) from the stand-in server of
+`smear_stub.py` in three ways, and checks that they give the same table:
+- one request for all variables (per averaging type), as the default mode;
+- one request per variable, one at a time, as the former `-v` mode;
+- one request per variable, concurrently over a keep-alive session;
+- batches planned by `preproc_smear.plan_requests`, concurrently.
+
+Usage: python benchmarks/bench_smear_fetch.py [-j WORKERS] [--latency SECONDS]
+                                              [--batch-values N]
+
+"""
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import preproc_smear  # noqa: E402
+import smear_stub  # noqa: E402
+
+varnames = ['Pamb0', 'T1250', 'T672', 'T504', 'T336', 'T168', 'T84', 'T42',
+            'RHIRGA1250', 'RHIRGA672', 'RHIRGA504', 'RHIRGA336',
+            'RHIRGA168', 'RHIRGA84', 'RHIRGA42',
+            'RPAR', 'PAR', 'diffPAR', 'maaPAR',
+            'tsoil_humus', 'tsoil_A', 'tsoil_B1', 'tsoil_B2', 'tsoil_C1',
+            'wsoil_humus', 'wsoil_A', 'wsoil_B1', 'wsoil_B2', 'wsoil_C1',
+            'Precipacc']
+start_dt = '2016-04-01 00:00:00'
+end_dt = '2016-11-11 00:00:00'
+
+
+def avg_type(var):
+    return 'SUM' if var == 'Precipacc' else 'ARITHMETIC'
+
+
+def timed_fetch(requests_list, max_workers, url):
+    t0 = time.perf_counter()
+    df, _ = preproc_smear.fetch_concurrently(
+        requests_list, start_dt, end_dt, max_workers, url,
+        print_status=False)
+    return df, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark SMEAR fetching against a local stand-in.')
+    parser.add_argument('-j', '--workers', dest='n_workers', type=int,
+                        default=8, help='number of concurrent requests')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='server time per request, in seconds')
+    parser.add_argument('--value-time', type=float, default=2e-7,
+                        help='server time per value, in seconds')
+    parser.add_argument('--batch-values', type=int, default=50000,
+                        help='target number of values per planned request')
+    args = parser.parse_args()
+
+    server, url = smear_stub.start_server(0, args.latency, args.value_time)
+    try:
+        df_batched, time_batched = timed_fetch(
+            [(varnames[0:-1], 'ARITHMETIC'), (varnames[-1:], 'SUM')],
+            1, url)
+        per_variable = [([var], avg_type(var)) for var in varnames]
+        df_serial, time_serial = timed_fetch(per_variable, 1, url)
+        df_concurrent, time_concurrent = timed_fetch(
+            per_variable, args.n_workers, url)
+        planned = preproc_smear.plan_requests(
+            varnames, [avg_type(var) for var in varnames], start_dt, end_dt,
+            args.batch_values)
+        df_planned, time_planned = timed_fetch(planned, args.n_workers, url)
+    finally:
+        server.shutdown()
+
+    pd.testing.assert_frame_equal(df_batched, df_serial)
+    pd.testing.assert_frame_equal(df_batched, df_concurrent)
+    pd.testing.assert_frame_equal(df_batched, df_planned)
+
+    print('Fetching %d variables x %d time steps, server latency %g s:' %
+          (len(varnames), df_batched.shape[0], args.latency))
+    print('  single request (per averaging type): %8.2f s' % time_batched)
+    print('  per variable, serial:                %8.2f s' % time_serial)
+    print('  per variable, %2d concurrent:         %8.2f s' %
+          (args.n_workers, time_concurrent))
+    print('  %2d planned batches, %2d concurrent:     %8.2f s' %
+          (len(planned), args.n_workers, time_planned))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""
+Benchmark suite of the preprocessing scripts on synthetic data.
+
+Generates a synthetic data tree of a scale preset with `synthetic_data.py`,
+serves the SMEAR data from the stand-in server of `smear_stub.py`, and runs
+each stage (the `main(argv)` of a `hyy16_*` script) in its own process with
+`preproc_config` pointed at the tree. The wall time, the CPU time and the peak
+resident memory of each stage, including its worker processes, are stored in
+a JSON result file, to be compared with a previous result for regressions.
+
+Each repeat of a stage starts with its outputs and caches removed, unless
+`--keep-cache` is given to time the incremental runs after the first.
+
+Usage: python benchmarks/bench_suite.py [STAGE ...] [-s SCALE] [-j JOBS]
+                                        [--stream] [-r REPEAT] [-d DIR]
+                                        [-o RESULTS] [-l LABEL] [--keep-cache]
+                                        [--compare FILE] [--tolerance RATIO]
+
+e.g., to check a change against the last commit,
+    git stash; python benchmarks/bench_suite.py -s season -l before
+    git stash pop; python benchmarks/bench_suite.py -s season -l after \\
+        --compare benchmarks/results/before_season.json
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_dir)
+import smear_stub  # noqa: E402
+import synthetic_data  # noqa: E402
+
+# stages: script module, keys of the output and cache directories to clear
+# before a cold run
+stages = [
+    {'name': 'fetch', 'module': 'hyy16_fetch_smear_data',
+     'outputs': ['met_data'], 'caches': ['smear_chunks', 'smear_responses']},
+    {'name': 'flow', 'module': 'hyy16_flow_data',
+     'outputs': ['flow_data_reformatted'], 'caches': ['flow_data_cache']},
+    {'name': 'sensor', 'module': 'hyy16_sensor_data',
+     'outputs': ['sensor_data_reformatted'], 'caches': ['sensor_file_index']},
+    {'name': 'leaf_area', 'module': 'hyy16_leaf_area',
+     'outputs': ['leaf_area_data_reformatted'], 'caches': []},
+]
+
+# bootstrap of a stage process
+_stage_code = (
+    'import sys; sys.path[:0] = [%r, %r]; import bench_suite; '
+    'sys.exit(bench_suite.run_stage(*sys.argv[1:]))' % (bench_dir, repo_dir))
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory in MiB of the largest of this process and its
+    waited-for children.
+
+    On Linux, the peak of this process is read from `/proc/self/status`, as
+    `ru_maxrss` also counts the memory of the parent before `exec`.
+    """
+    # in KiB on Linux, in bytes on macOS
+    unit = 1024. ** 2 if sys.platform == 'darwin' else 1024.
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    try:
+        with open('/proc/self/status', 'r') as f:
+            peak_self = [int(line.split()[1]) for line in f
+                         if line.startswith('VmHWM:')][0] * 1024. / unit
+    except (IOError, OSError, IndexError):
+        peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max(peak_self, peak_children) / unit
+
+
+def run_stage(root, module_name, argv_json, report_path):
+    """
+    Run a stage script with `preproc_config` pointed at a synthetic data tree,
+    in the process of the stage, and write its peak memory to a report file.
+    """
+    import importlib
+    import preproc_config
+    preproc_config.data_dir.update(
+        {key: os.path.join(root, subdir)
+         for key, subdir in synthetic_data.config_dirs.items()})
+    preproc_config.run_options.update({
+        'process_recent_period': False, 'use_run_manifest': False,
+        'plot_flow_data': False, 'plot_sensor_data': False})
+    module = importlib.import_module(module_name)
+    status = module.main(json.loads(argv_json))
+    with open(report_path, 'w') as f:
+        json.dump({'max_rss_mb': peak_memory_mb()}, f)
+    return status
+
+
+def _clear(path):
+    """Remove a file, or the contents of a directory."""
+    if os.path.isdir(path):
+        for entry in os.listdir(path):
+            entry = os.path.join(path, entry)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            else:
+                os.remove(entry)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def time_stage(root, stage, argv, log_path, keep_cache=False):
+    """
+    Run a stage in a new process, and measure it.
+
+    Return
+    ------
+    result : dict
+        The exit code, the wall time and the CPU time (user + system) in
+        seconds, and the peak resident memory in MiB of the largest process
+        of the stage, i.e., the stage or one of its worker processes.
+
+    """
+    keys = stage['outputs'] + ([] if keep_cache else stage['caches'])
+    for key in keys:
+        _clear(os.path.join(root, synthetic_data.config_dirs[key]))
+    report_path = log_path + '.json'
+    _clear(report_path)
+    with open(log_path, 'w') as log_file:
+        time_start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-c', _stage_code, root, stage['module'],
+             json.dumps(argv), report_path], cwd=repo_dir, stdout=log_file,
+            stderr=subprocess.STDOUT)
+        # the resource usage of this process and its waited-for children only
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - time_start
+        process.returncode = os.WEXITSTATUS(status) \
+            if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    try:
+        with open(report_path, 'r') as f:
+            max_rss_mb = json.load(f)['max_rss_mb']
+    except (IOError, OSError, ValueError):
+        max_rss_mb = None  # the stage has not finished normally
+    return {'exit_code': process.returncode, 'wall_time': wall_time,
+            'cpu_time': rusage.ru_utime + rusage.ru_stime,
+            'max_rss_mb': max_rss_mb}
+
+
+def git_commit():
+    """The current commit of the repository, or None if unknown."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir,
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline, results, tolerance=0.1):
+    """
+    Print the ratios of the stage times and memory to a baseline result.
+
+    Return
+    ------
+    regressions : list of str
+        Stages slower (by wall time) or larger (by peak memory) than the
+        baseline by more than the tolerance ratio.
+
+    """
+    print('\nComparison with %s (%s, %s):' % (
+        baseline['label'], baseline['commit'], baseline['created']))
+    print('%-12s%12s%12s%8s%12s%12s%8s' % (
+        'Stage', 'Wall (s)', 'base', 'ratio', 'RSS (MiB)', 'base', 'ratio'))
+    regressions = []
+    for name, result in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None or base['exit_code'] != 0 or \
+                result['exit_code'] != 0:
+            continue
+        wall_ratio = result['wall_time'] / base['wall_time']
+        rss_ratio = result['max_rss_mb'] / base['max_rss_mb']
+        flag = ''
+        if wall_ratio > 1. + tolerance or rss_ratio > 1. + tolerance:
+            regressions.append(name)
+            flag = '  <- regression'
+        print('%-12s%12.2f%12.2f%8.2f%12.1f%12.1f%8.2f%s' % (
+            name, result['wall_time'], base['wall_time'], wall_ratio,
+            result['max_rss_mb'], base['max_rss_mb'], rss_ratio, flag))
+    return regressions
+
+
+def main():
+    stage_names = [stage['name'] for stage in stages]
+    parser = argparse.ArgumentParser(
+        description='Benchmark the preprocessing scripts on synthetic data.')
+    parser.add_argument('stages', nargs='*', metavar='STAGE',
+                        help='stages to run: ' + ', '.join(stage_names) +
+                        '; default is all')
+    parser.add_argument('-s', '--scale', default='week',
+                        choices=sorted(synthetic_data.scales),
+                        help='scale preset of the synthetic data')
+    parser.add_argument('-j', '--jobs', dest='n_jobs', type=int, default=1,
+                        help='number of worker processes of the flow and ' +
+                        'the sensor stages')
+    parser.add_argument('--stream', dest='flag_stream', action='store_true',
+                        help='run the flow stage in streaming mode')
+    parser.add_argument('-r', '--repeat', dest='n_repeat', type=int,
+                        default=1, help='number of runs of each stage')
+    parser.add_argument('-d', '--data-dir', dest='data_dir', default=None,
+                        help='directory of the synthetic data, reused if ' +
+                        'generated at the same scale; default is a ' +
+                        'temporary directory')
+    parser.add_argument('-o', '--output', dest='results_dir',
+                        default=os.path.join(bench_dir, 'results'),
+                        help='directory of the result files')
+    parser.add_argument('-l', '--label', default=None,
+                        help='label of the result file; default is the ' +
+                        'current commit')
+    parser.add_argument('--keep-cache', dest='flag_keep_cache',
+                        action='store_true',
+                        help='keep the caches between the repeats')
+    parser.add_argument('--compare', dest='baseline', default=None,
+                        help='result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='ratio of slowdown or memory growth to report ' +
+                        'as regression')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='server time per request of the SMEAR stand-in')
+    parser.add_argument('--value-time', type=float, default=2e-7,
+                        help='server time per value of the SMEAR stand-in')
+    args = parser.parse_args()
+    for name in args.stages:
+        if name not in stage_names:
+            parser.error('unknown stage: %s' % name)
+    selected = [stage for stage in stages
+                if not args.stages or stage['name'] in args.stages]
+    preset = synthetic_data.scales[args.scale]
+
+    if args.data_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        root = tmp_dir.name
+    else:
+        tmp_dir = None
+        root = os.path.abspath(args.data_dir)
+        os.makedirs(root, exist_ok=True)
+
+    # generate the data, unless already there at the same scale
+    summary_path = os.path.join(root, 'synthetic_data.json')
+    try:
+        with open(summary_path, 'r') as f:
+            summary = json.load(f)
+    except (IOError, OSError, ValueError):
+        summary = None
+    if summary is None or summary['preset'] != preset:
+        print('Generating synthetic data at the %s scale in %s ...' %
+              (args.scale, root))
+        time_start = time.perf_counter()
+        summary = {'preset': preset,
+                   'records': synthetic_data.generate(root, args.scale)}
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        print('Generated in %.2f seconds: %s' % (
+            time.perf_counter() - time_start,
+            ', '.join('%d %s records' % (n, key)
+                      for key, n in sorted(summary['records'].items()))))
+
+    # SMEAR stand-in, at the time step of the density of the preset
+    server, url = smear_stub.start_server(
+        0, args.latency, args.value_time, 1800 // preset['density'])
+    stage_argv = {
+        'fetch': ['-u', url],
+        'flow': ['-s', '-j', str(args.n_jobs)] +
+        (['--stream'] if args.flag_stream else []),
+        'sensor': ['-s', '-j', str(args.n_jobs)],
+        'leaf_area': [],
+    }
+
+    results = {
+        'label': args.label or git_commit() or 'unknown',
+        'commit': git_commit(),
+        'created': datetime.datetime.now().strftime('%Y-%m-%d %X'),
+        'scale': args.scale,
+        'preset': preset,
+        'records': summary['records'],
+        'n_jobs': args.n_jobs,
+        'stream': args.flag_stream,
+        'n_repeat': args.n_repeat,
+        'keep_cache': args.flag_keep_cache,
+        'versions': {'python': sys.version.split()[0],
+                     'numpy': np.__version__, 'pandas': pd.__version__},
+        'stages': {},
+    }
+    log_dir = os.path.join(root, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    print('\n%-12s%8s%12s%12s%12s' % (
+        'Stage', 'Run', 'Wall (s)', 'CPU (s)', 'RSS (MiB)'))
+    try:
+        for stage in selected:
+            runs = []
+            for i in range(args.n_repeat):
+                log_path = os.path.join(log_dir, '%s_%d.log' % (
+                    stage['name'], i))
+                run = time_stage(root, stage, stage_argv[stage['name']],
+                                 log_path, args.flag_keep_cache)
+                runs.append(run)
+                print('%-12s%8d%12.2f%12.2f%12s' % (
+                    stage['name'], i, run['wall_time'], run['cpu_time'],
+                    '-' if run['max_rss_mb'] is None else
+                    '%.1f' % run['max_rss_mb']))
+                if run['exit_code'] != 0:
+                    with open(log_path, 'r') as f:
+                        log_tail = f.readlines()[-10:]
+                    print('Failed (exit code %d), end of the log:\n%s' % (
+                        run['exit_code'], ''.join(log_tail)))
+            # the fastest run by wall time, and the largest by memory
+            rss_runs = [run['max_rss_mb'] for run in runs
+                        if run['max_rss_mb'] is not None]
+            results['stages'][stage['name']] = {
+                'exit_code': max([run['exit_code'] for run in runs],
+                                 key=abs),
+                'wall_time': min(run['wall_time'] for run in runs),
+                'cpu_time': min(run['cpu_time'] for run in runs),
+                'max_rss_mb': max(rss_runs) if rss_runs else None,
+                'runs': runs,
+            }
+    finally:
+        server.shutdown()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir, '%s_%s.json' % (
+        results['label'], args.scale))
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('Results saved to %s' % results_path)
+
+    status = int(any(result['exit_code'] != 0
+                     for result in results['stages'].values()))
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['scale'] != args.scale:
+            print('Warning: the baseline is at the %s scale.' %
+                  baseline['scale'])
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print('Regressions beyond %.0f%%: %s' % (
+                100. * args.tolerance, ', '.join(regressions)))
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
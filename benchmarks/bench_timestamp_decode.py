@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of timestamp decoding for the sensor data files.
+
+Compares the per-row `date_parser` lambda formerly passed to
+`pandas.read_csv()` in `hyy16_sensor_data.py` with the vectorized decoder
+`preproc_io.parse_timestamp_digits()`, on a synthetic full day of leaf chamber
+sensor data (17,280 records at 5 s step).
+
+Usage: python benchmarks/bench_timestamp_decode.py [-n REPEAT]
+
+"""
+import os
+import sys
+import argparse
+import datetime
+import tempfile
+import timeit
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import preproc_io  # noqa: E402
+
+
+def lambda_parser(s):
+    """The former timestamp parser in `hyy16_sensor_data.py`."""
+    return np.datetime64(
+        '%s-%s-%s %s:%s:%s' % (s[0:4], s[4:6], s[6:8],
+                               s[8:10], s[10:12], s[12:14]))
+
+
+def read_with_lambda(filepath):
+    """Read the timestamps of a file as formerly, with the per-row lambda."""
+    return pd.read_csv(
+        filepath, sep='\\s+', usecols=[0], names=['datetime'],
+        dtype={'datetime': str}, parse_dates={'timestamp': [0]},
+        date_parser=lambda_parser, engine='c')
+
+
+def read_with_decoder(filepath):
+    """Read the timestamps of a file with the vectorized decoder."""
+    df = pd.read_csv(filepath, sep='\\s+', usecols=[0], names=['datetime'],
+                     dtype={'datetime': str}, engine='c')
+    df.insert(0, 'timestamp',
+              preproc_io.parse_timestamp_digits(df.pop('datetime').values))
+    return df
+
+
+def write_day_file(filepath, date=datetime.datetime(2016, 7, 1)):
+    """Write a synthetic full day of leaf chamber sensor data (*.cop)."""
+    rng = np.random.RandomState(0)
+    timestamps = pd.date_range(date, periods=17280, freq='5S')
+    values = rng.normal(10., 1., (timestamps.size, 12))
+    df = pd.DataFrame(values)
+    df.insert(0, 'datetime', timestamps.strftime('%Y%m%d%H%M%S'))
+    df.to_csv(filepath, sep=' ', header=False, index=False,
+              float_format='%.2f')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark timestamp decoding of sensor data files.')
+    parser.add_argument('-n', '--repeat', dest='n_repeat', type=int,
+                        default=5, help='number of repeats for timing')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, 'sm160701.cop')
+        write_day_file(filepath)
+        datetime_strings = pd.read_csv(
+            filepath, sep='\\s+', usecols=[0], names=['datetime'],
+            dtype={'datetime': str}, engine='c')['datetime'].values
+        # `date_parser` is no longer supported by recent pandas versions
+        try:
+            time_read_lambda = min(timeit.repeat(
+                lambda: read_with_lambda(filepath),
+                number=1, repeat=args.n_repeat))
+        except TypeError:
+            time_read_lambda = None
+        time_read_decoder = min(timeit.repeat(
+            lambda: read_with_decoder(filepath),
+            number=1, repeat=args.n_repeat))
+
+    # both decoders must agree before timing them
+    decoded_lambda = np.array([lambda_parser(s) for s in datetime_strings],
+                              dtype='datetime64[s]')
+    decoded_vectorized = preproc_io.parse_timestamp_digits(datetime_strings)
+    assert np.array_equal(decoded_lambda, decoded_vectorized)
+
+    time_lambda = min(timeit.repeat(
+        lambda: [lambda_parser(s) for s in datetime_strings],
+        number=1, repeat=args.n_repeat))
+    time_vectorized = min(timeit.repeat(
+        lambda: preproc_io.parse_timestamp_digits(datetime_strings),
+        number=1, repeat=args.n_repeat))
+
+    print('Decoding %d timestamps (one day of 5 s records), best of %d:' %
+          (datetime_strings.size, args.n_repeat))
+    print('  per-row lambda:      %8.2f ms' % (time_lambda * 1e3))
+    print('  vectorized decoder:  %8.2f ms' % (time_vectorized * 1e3))
+    print('  speedup:             %8.1fx' % (time_lambda / time_vectorized))
+
+    print('Reading the timestamp column of the file, best of %d:' %
+          args.n_repeat)
+    if time_read_lambda is not None:
+        print('  with date_parser:    %8.2f ms' % (time_read_lambda * 1e3))
+    else:
+        print('  with date_parser:    not supported by pandas %s' %
+              pd.__version__)
+    print('  with decoder:        %8.2f ms' % (time_read_decoder * 1e3))
+    if time_read_lambda is not None:
+        print('  speedup:             %8.1fx' %
+              (time_read_lambda / time_read_decoder))
+
+
+if __name__ == '__main__':
+    main()
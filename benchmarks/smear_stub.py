@@ -0,0 +1,152 @@
+"""
+Local stand-in of the SMEAR data API (`smeardata.jsp`), for offline runs and
+benchmarks of `hyy16_fetch_smear_data.py`.
+
+Responds to the same query parameters ('variables', 'table', 'from', 'to',
+'averaging', 'type') with a CSV table in the format of the real API: the
+columns 'Year' to 'Second', followed by one column per variable. Values are
+synthetic and deterministic, so that repeated queries give the same data. An
+artificial latency per request and per value mimics the server time. A time
+step shorter than the 30 min of the API gives proportionally larger responses,
+to emulate longer records.
+
+Usage: python benchmarks/smear_stub.py [--port PORT] [--latency SECONDS]
+                                       [--value-time SECONDS] [--step SECONDS]
+
+Then run, e.g.,
+    python hyy16_fetch_smear_data.py -u http://127.0.0.1:PORT/smeardata.jsp
+
+"""
+import time
+import zlib
+import argparse
+import datetime
+import threading
+import socketserver
+import http.server
+import urllib.parse
+import numpy as np
+
+
+def synthetic_values(variable, n_rows, row_offset, rows_per_day=48):
+    """Deterministic synthetic values of a variable, by row number."""
+    seed = zlib.crc32(variable.encode('utf-8'))
+    rows = np.arange(row_offset, row_offset + n_rows)
+    values = (seed % 1000) / 10. + \
+        5. * np.sin(2. * np.pi * rows / rows_per_day + seed % 7)
+    if variable == 'Pamb0':
+        values[rows % 97 == 0] = 0.  # occasional zero pressure, as in the API
+    return values
+
+
+def smear_table(query, step=1800):
+    """
+    Make the CSV response body of a query.
+
+    The time steps are `step` seconds (default 30 min), from 'from' (included)
+    to 'to' (excluded).
+    """
+    variables = [v for v in query['variables'][0].split(',') if v]
+    table = query.get('table', ['HYY_META'])[0]
+    start = datetime.datetime.strptime(query['from'][0], '%Y-%m-%d %H:%M:%S')
+    end = datetime.datetime.strptime(query['to'][0], '%Y-%m-%d %H:%M:%S')
+    # rows are numbered from a fixed origin, so that the values of a time
+    # step do not depend on the range of the query
+    origin = datetime.datetime(2016, 1, 1)
+    row_offset = int((start - origin).total_seconds() // step)
+    n_rows = max(int(-(-(end - start).total_seconds() // step)), 0)
+    timestamps = np.datetime64(start, 's') + \
+        np.arange(n_rows) * np.timedelta64(step, 's')
+    values = [synthetic_values(v, n_rows, row_offset, 86400. / step)
+              for v in variables]
+
+    lines = ['Year,Month,Day,Hour,Minute,Second,' +
+             ','.join('%s.%s' % (table, v) for v in variables)]
+    for i, ts in enumerate(timestamps.astype(datetime.datetime)):
+        lines.append('%d,%d,%d,%d,%d,%d,' % (
+            ts.year, ts.month, ts.day, ts.hour, ts.minute, ts.second) +
+            ','.join('%.4f' % v[i] for v in values))
+    return ('\n'.join(lines) + '\n').encode('utf-8'), n_rows * len(variables)
+
+
+class SmearRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of `smeardata.jsp` queries, with keep-alive connections."""
+    protocol_version = 'HTTP/1.1'
+    latency = 0.
+    value_time = 0.
+    step = 1800
+    lock = threading.Lock()
+    n_requests = 0
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if not url.path.endswith('smeardata.jsp') or \
+                'variables' not in query:
+            self.send_error(404)
+            return
+        body, n_values = smear_table(query, self.step)
+        with self.lock:
+            type(self).n_requests += 1
+        time.sleep(self.latency + self.value_time * n_values)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # quiet
+
+
+class SmearStubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded stand-in server of the SMEAR API."""
+    daemon_threads = True
+
+
+def start_server(port=0, latency=0., value_time=0., step=1800):
+    """
+    Start a stand-in server in a background thread.
+
+    Return
+    ------
+    server : SmearStubServer
+        The server; call `server.shutdown()` to stop it.
+    url : str
+        URL of the stand-in `smeardata.jsp`.
+
+    """
+    handler = type('Handler', (SmearRequestHandler,),
+                   {'latency': latency, 'value_time': value_time,
+                    'step': step})
+    server = SmearStubServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d/smeardata.jsp' % \
+        server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local stand-in of the SMEAR data API.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='server time per request, in seconds')
+    parser.add_argument('--value-time', type=float, default=2e-7,
+                        help='server time per value, in seconds')
+    parser.add_argument('--step', type=int, default=1800,
+                        help='time step of the data, in seconds')
+    args = parser.parse_args()
+    server, url = start_server(args.port, args.latency, args.value_time,
+                               args.step)
+    print('Serving the SMEAR stand-in at %s (Ctrl-C to stop)' % url)
+    try:
+        while True:
+            time.sleep(3600.)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Generators of realistic synthetic raw data, for offline benchmarks of the
+preprocessing scripts.
+
+Writes a data tree with the raw data files in the formats of the instruments,
+and the output and cache directories of the scripts:
+
+| directory              | contents                                          |
+|------------------------|---------------------------------------------------|
+| `flow_raw/`            | flowmeter files `data_N.dat`: tab-separated time  |
+|                        | in seconds since 1904 and 6 flow rates, ~1 s step |
+| `sensor_raw/sm_cop/`   | leaf chamber sensor files `smYYMMDD.cop`, 5 s     |
+| `sensor_raw/sm_mpr/`   | soil chamber sensor files `smYYMMDD.mpr`, 5 s     |
+| `leaf_area_raw/`       | `chamber_metadata.csv` and the aspen leaf area    |
+|                        | tables `aspen_leaf_area_<ch_label>.csv`           |
+
+SMEAR met data are served by the stand-in server of `smear_stub.py`.
+
+The scripts cover the fixed campaign window of 2016 (flow files 40-339,
+DOY 97-314, SMEAR data from 1 April to 11 November), so a longer record is
+emulated by a denser one: a scale preset has a range of days and a density,
+the number of records per instrument time step. The '5year' preset has the
+records of five seasons in the campaign window.
+
+Usage: python benchmarks/synthetic_data.py DIR [-s SCALE]
+
+"""
+import os
+import argparse
+import datetime
+import numpy as np
+
+
+# scale presets: first day (day of year of 2016), number of days, and density
+scales = {
+    'week': {'doy_start': 182, 'n_days': 7, 'density': 1},
+    'season': {'doy_start': 97, 'n_days': 218, 'density': 1},
+    '5year': {'doy_start': 97, 'n_days': 218, 'density': 5},
+}
+
+# subdirectories of the data tree, by key of `preproc_config.data_dir`
+config_dirs = {
+    'flow_data_raw': 'flow_raw/',
+    'flow_data_reformatted': 'output/flow/',
+    'flow_data_cache': 'cache/flow/',
+    'sensor_data_raw': 'sensor_raw/',
+    'sensor_data_reformatted': 'output/sensor/',
+    'sensor_file_index': 'cache/sensor_files.json',
+    'smear_chunks': 'cache/smear/',
+    'smear_responses': 'cache/smear_responses/',
+    'met_data': 'output/met/',
+    'leaf_area_data_raw': 'leaf_area_raw/',
+    'leaf_area_data_reformatted': 'output/leaf_area/',
+    'chflux_data': 'output/chflux/',
+    'pipeline': 'cache/pipeline/',
+}
+
+# time origin of the flowmeter logger, in seconds since 1 Jan 1904
+time_sec_2016 = (datetime.datetime(2016, 1, 1) -
+                 datetime.datetime(1904, 1, 1)).total_seconds()
+
+
+def _write_rows(filepath, row_format, values, block_rows=100000,
+                na_rep=None):
+    """
+    Write the rows of a 2-D array by a format string, in blocks of rows; this
+    is several times faster than `numpy.savetxt`. NaN is written as `na_rep`
+    if given.
+    """
+    with open(filepath, 'w') as f:
+        for i in range(0, values.shape[0], block_rows):
+            block = values[i:i + block_rows]
+            text = (row_format * block.shape[0]) % \
+                tuple(block.ravel().tolist())
+            if na_rep is not None:
+                text = text.replace('nan', na_rep)
+            f.write(text)
+
+
+def _diurnal(hours, phase=14.):
+    """Diurnal cycle from -1 to 1, peaking at `phase` hours."""
+    return np.cos(2. * np.pi * (hours - phase) / 24.)
+
+
+def write_flow_files(flow_dir, doy_start, n_days, density=1, seed=0):
+    """
+    Write the flowmeter files `data_N.dat` of a range of days.
+
+    File N starts at 07:12 on day of year N, as the logger was restarted each
+    morning, and holds a day of records at about `1 / density` s step, with a
+    random gap of up to 10 min and rare spikes.
+
+    Return
+    ------
+    n_rows : int
+        Total number of records written.
+
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(flow_dir, exist_ok=True)
+    step = 1. / density
+    n_per_file = int(86400. / step)
+    # outlet flow, then the leaf chambers 1-3 and the soil chambers 4-5
+    levels = np.array([1.0, 1.2, 1.2, 1.2, 1.5, 1.5])
+    n_rows = 0
+    for doy in range(doy_start, doy_start + n_days):
+        t = time_sec_2016 + (doy + 0.3) * 86400. + \
+            np.arange(n_per_file) * step + \
+            rng.uniform(0., 0.3 * step, n_per_file)
+        hours = (t - time_sec_2016) / 3600. % 24.
+        flow = levels + 0.05 * _diurnal(hours)[:, np.newaxis] + \
+            rng.normal(0., 0.01, (n_per_file, levels.size))
+        spikes = rng.randint(0, n_per_file, 5)
+        flow[spikes] *= rng.uniform(0.2, 3., (spikes.size, levels.size))
+        values = np.column_stack((t, flow))
+        gap_start = rng.randint(0, n_per_file)
+        values = np.delete(values, np.s_[gap_start:gap_start + int(
+            rng.uniform(0., 600.) / step)], axis=0)
+        _write_rows(os.path.join(flow_dir, 'data_%d.dat' % doy),
+                    '%.6f' + '\t%.6f' * levels.size + '\n', values)
+        n_rows += values.shape[0]
+    return n_rows
+
+
+def _sensor_day(doy, density, rng, n_columns):
+    """Timestamps (as 'YYYYmmddHHMMSS' numbers) and hours of a sensor day."""
+    step = max(int(round(5. / density)), 1)
+    seconds = np.arange(0, 86400, step)
+    date = datetime.datetime(2016, 1, 1) + datetime.timedelta(doy)
+    stamps = float(date.strftime('%Y%m%d')) * 1e6 + \
+        seconds // 3600 * 10000 + seconds % 3600 // 60 * 100 + seconds % 60
+    values = np.empty((seconds.size, n_columns + 1))
+    values[:, 0] = stamps
+    return values, seconds / 3600., date
+
+
+def write_sensor_files(sensor_dir, doy_start, n_days, density=1, seed=1):
+    """
+    Write the leaf chamber (*.cop) and soil chamber (*.mpr) sensor files of a
+    range of days, one file of each per day, at `5 / density` s step.
+
+    The leaf chamber files have 12 value columns: PAR signals in columns 1-2,
+    temperatures in columns 8 and 10-12, and missing values as '-'. The soil
+    chamber files have 7, with the soil chamber temperatures in columns 5-7.
+
+    Return
+    ------
+    n_rows : int
+        Total number of records written, of both file types.
+
+    """
+    rng = np.random.RandomState(seed)
+    for subdir in ['sm_cop', 'sm_mpr']:
+        os.makedirs(os.path.join(sensor_dir, subdir), exist_ok=True)
+    n_rows = 0
+    for doy in range(doy_start, doy_start + n_days):
+        # leaf chamber sensors
+        values, hours, date = _sensor_day(doy, density, rng, 12)
+        n = hours.size
+        cloudiness = np.clip(rng.normal(0.8, 0.1, n), 0., 1.)
+        par = np.clip(1500. * _diurnal(hours, 12.) - 300., 0., None) * \
+            cloudiness
+        # PAR sensor signals, about 200 umol m-2 s-1 per unit
+        values[:, 1:3] = par[:, np.newaxis] / 200. + \
+            rng.normal(0., 0.02, (n, 2))
+        values[:, 3:13] = 10. + rng.normal(0., 1., (n, 10))
+        values[:, 8:13] += 5. * _diurnal(hours)[:, np.newaxis]
+        values[:, 1:13][rng.uniform(size=(n, 12)) < 1e-3] = np.nan
+        _write_rows(os.path.join(sensor_dir, 'sm_cop',
+                                 'sm%s.cop' % date.strftime('%y%m%d')),
+                    '%d' + ' %.2f' * 12 + '\n', values, na_rep='-')
+        # soil chamber sensors
+        values, hours, date = _sensor_day(doy, density, rng, 7)
+        values[:, 1:8] = 8. + rng.normal(0., 0.2, (hours.size, 7))
+        values[:, 5:8] += 1.5 * _diurnal(hours, 17.)[:, np.newaxis]
+        _write_rows(os.path.join(sensor_dir, 'sm_mpr',
+                                 'sm%s.mpr' % date.strftime('%y%m%d')),
+                    '%d' + ' %.2f' * 7 + '\n', values)
+        n_rows += 2 * hours.size
+    return n_rows
+
+
+def write_leaf_area_files(leaf_area_dir, doy_start, n_days, density=1,
+                          seed=2):
+    """
+    Write the chamber metadata and the aspen leaf area tables.
+
+    The pine chambers are reinstalled on new shoots every `30 / density` days,
+    and the aspen leaves are measured every `3 / density` days, from the
+    middle of the range.
+
+    Return
+    ------
+    n_rows : int
+        Total number of rows written.
+
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(leaf_area_dir, exist_ok=True)
+    t_start = np.datetime64('2016-01-01T09:00') + \
+        np.timedelta64(doy_start, 'D')
+    t_end = t_start + np.timedelta64(n_days, 'D')
+    header = ['ch_no', 'ch_label', 'species', 'leaf_area', 'n_shoots',
+              'ch_volume', 'ch_area', 'sensor_PAR', 'sensor_T', 'tc_no',
+              'flow_ch', 'is_leaf_ch', 'is_soil_ch', 'location',
+              'install_datetime', 'uninstall_datetime', 'note']
+    lines = [','.join(header)]
+    reinstall = np.timedelta64(int(30. * 1440. / density), 'm')
+    for ch_no, ch_label, leaf_area in [(1, 'LC-S-A', 0.05),
+                                       (2, 'LC-S-B', 0.04),
+                                       (3, 'LC-L-A', 0.3)]:
+        install = t_start
+        while install < t_end:
+            uninstall = min(install + reinstall, t_end)
+            lines.append('%d,%s,pine,%.4f,%d,0.5,0.1,%d,%d,%d,%d,1,0,A,'
+                         '%s,%s,synthetic' % (
+                             ch_no, ch_label,
+                             leaf_area * rng.uniform(0.8, 1.2),
+                             rng.randint(1, 4), ch_no, ch_no, ch_no, ch_no,
+                             str(install).replace('T', ' '),
+                             str(uninstall).replace('T', ' ')))
+            # the new shoot is installed an hour later
+            install = uninstall + np.timedelta64(1, 'h')
+    for ch_no, ch_label in [(4, 'SC1'), (5, 'SC2'), (6, 'SC3')]:
+        lines.append('%d,%s,soil,,0,0.03,0.03,0,%d,%d,%d,0,1,B,%s,%s,'
+                     'synthetic' % (ch_no, ch_label, ch_no, ch_no, ch_no,
+                                    str(t_start).replace('T', ' '),
+                                    str(t_end).replace('T', ' ')))
+    with open(os.path.join(leaf_area_dir, 'chamber_metadata.csv'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    n_rows = len(lines) - 1
+
+    measure_times = np.arange(
+        t_start + np.timedelta64(n_days // 2, 'D'), t_end,
+        np.timedelta64(int(3. * 1440. / density), 'm'))
+    for ch_label, leaf_area in [('LC-XL', 0.02), ('LC-Slide', 0.015)]:
+        growth = np.linspace(0.5, 1., measure_times.size) * \
+            rng.uniform(0.95, 1.05, measure_times.size)
+        with open(os.path.join(leaf_area_dir,
+                               'aspen_leaf_area_%s.csv' % ch_label),
+                  'w') as f:
+            f.write('# synthetic leaf area measurements\n')
+            f.write('datetime,leaf_area,n_leaves\n')
+            for time, value in zip(measure_times, leaf_area * growth):
+                f.write('%s,%.6f,%d\n' % (str(time).replace('T', ' '),
+                                          value, rng.randint(3, 8)))
+        n_rows += measure_times.size
+    return n_rows
+
+
+def generate(root, scale='week'):
+    """
+    Generate the synthetic data tree of a scale preset.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the data tree; see `config_dirs` for its layout.
+    scale : str, optional
+        Scale preset; see `scales`. Default is 'week'.
+
+    Return
+    ------
+    summary : dict
+        Number of records written, keyed by data type.
+
+    """
+    preset = scales[scale]
+    args = (preset['doy_start'], preset['n_days'], preset['density'])
+    summary = {
+        'flow': write_flow_files(
+            os.path.join(root, config_dirs['flow_data_raw']), *args),
+        'sensor': write_sensor_files(
+            os.path.join(root, config_dirs['sensor_data_raw']), *args),
+        'leaf_area': write_leaf_area_files(
+            os.path.join(root, config_dirs['leaf_area_data_raw']), *args),
+    }
+    for subdir in config_dirs.values():
+        if subdir.endswith('/'):
+            os.makedirs(os.path.join(root, subdir), exist_ok=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic raw data for benchmarks.')
+    parser.add_argument('root', metavar='DIR',
+                        help='root directory of the data tree')
+    parser.add_argument('-s', '--scale', default='week',
+                        choices=sorted(scales), help='scale preset')
+    args = parser.parse_args()
+    summary = generate(args.root, args.scale)
+    for key in sorted(summary):
+        print('%-12s%12d records' % (key, summary[key]))
+
+
+if __name__ == '__main__':
+    main()
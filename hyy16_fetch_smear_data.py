@@ -6,53 +6,14 @@ Hyytiälä COS campaign, April-November 2016
 (c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
 
 """
-import io
+import os
+import sys
 import argparse
-import copy
 import datetime
-import requests
 import numpy as np
 import pandas as pd
 import preproc_config
-
-
-def timestamp_parser(*args):
-    """
-    A timestamp parser for `pandas.read_csv()`.
-    Argument list: year, month, day, hour, minute, second
-    """
-    return np.datetime64('%s-%s-%s %s:%s:%s' %
-                         args)
-
-
-# define terminal argument parser
-parser = argparse.ArgumentParser(description='Get SMEAR meteorological data.')
-parser.add_argument('-v', '--variable', dest='flag_get_variable',
-                    action='store_true',
-                    help='get one variable at a time, slow mode')
-parser.add_argument('-n', '--now', dest='flag_now', action='store_true',
-                    help='get the data from the starting date till now')
-args = parser.parse_args()
-
-
-# echo program starting
-print('Retrieving meteorological data from ' +
-      'SMEAR <http://avaa.tdata.fi/web/smart/smear> ... ')
-dt_start = datetime.datetime.now()
-print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
-print('numpy version = ' + np.__version__)
-print('pandas version = ' + pd.__version__)
-
-
-output_dir = preproc_config.data_dir['met_data']
-
-# local winter time is UTC+2
-start_dt = '2016-04-01 00:00:00'
-if not args.flag_now:
-    end_dt = '2016-11-11 00:00:00'
-else:
-    end_dt = (datetime.datetime.utcnow() +
-              datetime.timedelta(2. / 24.)).strftime('%Y-%m-%d %H:%M:%S')
+import preproc_smear
 
 
 # variable names for retrieval from the SMEAR data website API
@@ -99,162 +60,179 @@ renaming_dict = {
     'Precipacc': 'precip', }
 
 
-# an url example
-# url = 'http://avaa.tdata.fi/palvelut/smeardata.jsp?' +
-#       'variables=Pamb0,&table=HYY_META&' +
-#       'from=2016-04-01 00:00:00&to=2016-04-02 00:00:00&'
-#       'quality=ANY&averaging=30MIN&type=ARITHMETIC'
-
+def main(argv=None):
+    """
+    Fetch the SMEAR met data, and write them as a table.
 
-if not args.flag_get_variable:
-    # first, request all variables except precipitation
-    print("Fetching variables '%s' ..." % ', '.join(varnames[0:-1]), end=' ')
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. Default is None, for `sys.argv[1:]`.
 
-    avg_type = 'ARITHMETIC'
-    url = 'http://avaa.tdata.fi/palvelut/smeardata.jsp?variables=' + \
-        ','.join(varnames[0:-1]) + ',&table=HYY_META&from=' + \
-        start_dt + '&to=' + end_dt + \
-        '&quality=ANY&averaging=30MIN&type=' + avg_type
+    Return
+    ------
+    status : int
+        Exit status: 0 on success.
 
-    response = requests.get(url, verify=True)
-    # set `verify=True` to check SSL certificate
-    if response.status_code != 200:
-        print('Status %d: No response from the request.' %
-              response.status_code)
+    """
+    # define terminal argument parser
+    parser = argparse.ArgumentParser(
+        description='Get SMEAR meteorological data.')
+    parser.add_argument('-v', '--variable', dest='flag_get_variable',
+                        action='store_true',
+                        help='get one variable per request')
+    parser.add_argument('-n', '--now', dest='flag_now', action='store_true',
+                        help='get the data from the starting date till now')
+    parser.add_argument('-a', '--append', dest='flag_append',
+                        action='store_true',
+                        help='fetch only the data after the existing table, ' +
+                        'and append them to it')
+    parser.add_argument('-u', '--url', dest='base_url',
+                        default=preproc_smear.smear_url,
+                        help='URL of the SMEAR API `smeardata.jsp`, ' +
+                        'e.g., of a local stand-in server')
+    args = parser.parse_args(argv)
+
+    # echo program starting
+    print('Retrieving meteorological data from ' +
+          'SMEAR <http://avaa.tdata.fi/web/smart/smear> ... ')
+    dt_start = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
+    print('numpy version = ' + np.__version__)
+    print('pandas version = ' + pd.__version__)
+
+    output_dir = preproc_config.data_dir['met_data']
+    output_fname = output_dir + '/hyy16_met_data.csv'
+
+    # local winter time is UTC+2
+    start_dt = '2016-04-01 00:00:00'
+    if not args.flag_now:
+        end_dt = '2016-11-11 00:00:00'
     else:
-        print('Successful!')
-
-    df_met = pd.read_csv(
-        io.BytesIO(response.text.encode('utf-8')), sep=',', header=0,
-        names=['year', 'month', 'day', 'hour', 'minute', 'second',
-               *varnames[0:-1]],
-        parse_dates={'timestamp': [0, 1, 2, 3, 4, 5]},
-        date_parser=timestamp_parser,
-        engine='c', encoding='utf-8')
+        end_dt = (datetime.datetime.utcnow() +
+                  datetime.timedelta(2. / 24.)).strftime('%Y-%m-%d %H:%M:%S')
+
+    # an url example
+    # url = 'http://avaa.tdata.fi/palvelut/smeardata.jsp?' +
+    #       'variables=Pamb0,&table=HYY_META&' +
+    #       'from=2016-04-01 00:00:00&to=2016-04-02 00:00:00&'
+    #       'quality=ANY&averaging=30MIN&type=ARITHMETIC'
+
+    # precipitation must be summed not averaged over the 30 min interval
+    avg_types = ['SUM' if var == 'Precipacc' else 'ARITHMETIC'
+                 for var in varnames]
+
+    # in the append mode, fetch only from a short overlap before the last
+    # timestamp of the existing table, if it has the same columns
+    fetch_start_dt = start_dt
+    append_offset = None
+    if args.flag_append and os.path.isfile(output_fname) and \
+            preproc_smear.read_header(output_fname) == \
+            ['timestamp', 'doy'] + [renaming_dict[var] for var in varnames]:
+        last_dt = preproc_smear.last_timestamp(output_fname)
+        if last_dt is not None:
+            fetch_start_dt = max(start_dt, (
+                pd.Timestamp(last_dt) - pd.Timedelta(
+                    days=preproc_config.run_options['smear_overlap_days'])
+            ).strftime('%Y-%m-%d %H:%M:%S'))
+            append_offset = preproc_smear.rows_offset(output_fname,
+                                                      fetch_start_dt)
+            print('Appending to the existing table from %s.' % fetch_start_dt)
+
+    if not args.flag_get_variable:
+        # variables of the same averaging type in batches, of about
+        # `smear_batch_values` values per request and time window
+        requests_list = preproc_smear.plan_requests(
+            varnames, avg_types, fetch_start_dt, end_dt,
+            preproc_config.run_options['smear_batch_values'],
+            preproc_config.run_options['smear_window_days'])
+    else:
+        # one variable per request
+        requests_list = [([var], avg_type)
+                         for var, avg_type in zip(varnames, avg_types)]
+    print('%d variables in %d request(s) per time window.' %
+          (len(varnames), len(requests_list)))
+
+    # responses of repeated queries are served from the local cache, which also
+    # stands in for the API when it cannot be reached
+    if preproc_config.data_dir.get('smear_responses') is not None:
+        response_cache = preproc_smear.ResponseCache(
+            preproc_config.data_dir['smear_responses'],
+            preproc_config.run_options['smear_cache_ttl_hours'])
+    else:
+        response_cache = None
+
+    # the time range is split into windows; the requests of all windows are
+    # sent concurrently over a shared keep-alive session, and merged on the
+    # timestamps
+    # each completed window is saved, so that an interrupted run resumes from
+    # the missing windows
+    df_met, n_failed = preproc_smear.fetch_concurrently(
+        requests_list, fetch_start_dt, end_dt,
+        preproc_config.run_options['smear_connections'], args.base_url,
+        window_days=preproc_config.run_options['smear_window_days'],
+        chunk_dir=preproc_config.data_dir.get('smear_chunks'),
+        cache=response_cache)
+    # the variables of failed requests are NaN; they must not overwrite the
+    # valid rows of an existing table
+    if n_failed > 0 and os.path.isfile(output_fname):
+        print('%d request(s) failed; %s is left unchanged.' %
+              (n_failed, output_fname))
+        return 1
 
-    start_year = df_met['timestamp'][0].year
+    # mask zero pressure as NaN
+    df_met.loc[df_met['Pamb0'] == 0., 'Pamb0'] = np.nan
 
+    # convert timestamps to day of year, relative to the campaign year
     df_met.insert(
         1, 'doy',
-        (df_met['timestamp'] - pd.Timestamp('%d-01-01' % start_year)) /
+        (df_met['timestamp'] - pd.Timestamp(start_dt[0:4] + '-01-01')) /
         pd.Timedelta(days=1))
     print('Timestamps parsed.')
 
-    # mask zero pressure as NaN
-    df_met.loc[df_met['Pamb0'] == 0., 'Pamb0'] = np.nan
-
-    # append precipitation; it's treated separately due to different averaging
-    del url, response
-    print("Fetching variable '%s' ..." % varnames[-1], end=' ')
-    avg_type = 'SUM'
-    url = 'http://avaa.tdata.fi/palvelut/smeardata.jsp?variables=' + \
-        varnames[-1] + ',&table=HYY_META&from=' + \
-        start_dt + '&to=' + end_dt + \
-        '&quality=ANY&averaging=30MIN&type=' + avg_type
-
-    response = requests.get(url, verify=True)
-    # set `verify=True` to check SSL certificate
-    if response.status_code != 200:
-        print('Status %d: No response from the request.' %
-              response.status_code)
-    else:
-        print('Successful!')
-
-    df_precip = pd.read_csv(
-        io.BytesIO(response.text.encode('utf-8')), sep=',', header=0,
-        names=[varnames[-1]], usecols=[6],
-        parse_dates=False,
-        engine='c', encoding='utf-8')
-
-    df_met = pd.concat([df_met, df_precip], axis=1)
-else:
-    # one variable a time
-    # make a copy and insert custom timestamps
-    colnames = copy.copy(varnames)
-    colnames.insert(0, 'timestamp')
-    colnames.insert(1, 'doy')
-
-    df_met = pd.DataFrame(columns=colnames)
-
-    flag_timestamp_parsed = False
-
-    # fetch and dump data: dump each variable into TXT and combine 'em as CSV
-    for var in varnames:
-        print("Fetching variable '%s' ..." % var, end=' ')
-
-        # precipitation must be summed not averaged over the 30 min interval
-        if var != 'Precipacc':
-            avg_type = 'ARITHMETIC'
-        else:
-            avg_type = 'SUM'
-
-        url = 'http://avaa.tdata.fi/palvelut/smeardata.jsp?variables=' + \
-              var + ',&table=HYY_META&from=' + start_dt + '&to=' + end_dt + \
-              '&quality=ANY&averaging=30MIN&type=' + avg_type
-
-        response = requests.get(url, verify=True)
-        # set `verify=True` to check SSL certificate
-        if response.status_code != 200:
-            print(
-                "Status %d: No response from the request for variable '%s'." %
-                (response.status_code, var))
-            continue
-        else:
-            print('Successful!')
+    # round met variables to '%.6f' except precipitation
+    # keep 'precip' as '%.2f'. nothing to be done for it
+    # do not round day of year variable 'doy'
+    df_met = df_met.round({var: 6 for var in varnames[0:-1]})
 
-        if not flag_timestamp_parsed:
-            fetched_data = pd.read_csv(
-                io.BytesIO(response.text.encode('utf-8')), sep=',', header=0,
-                names=['year', 'month', 'day',
-                       'hour', 'minute', 'second', var],
-                parse_dates={'timestamp': [0, 1, 2, 3, 4, 5]},
-                date_parser=timestamp_parser,
-                engine='c', encoding='utf-8')
-        else:
-            fetched_data = pd.read_csv(
-                io.BytesIO(response.text.encode('utf-8')), sep=',', header=0,
-                names=[var], usecols=[6],
-                parse_dates=False,
-                engine='c', encoding='utf-8')
+    # renaming column names in the output dataframe
+    for col in df_met.columns.values:
+        if col in renaming_dict:
+            df_met.rename(columns={col: renaming_dict[col]}, inplace=True)
 
-        # if var == 'Pamb0':
-        #     fetched_data[var][fetched_data[var] == 0.] = np.nan
-        if var == 'Pamb0':
-            fetched_data.loc[fetched_data[var] == 0., var] = np.nan
+    print('Variable fields have been renamed in the output data.')
 
-        if not flag_timestamp_parsed:
-            # fill timestamps and convert to day of year
-            df_met['timestamp'] = fetched_data['timestamp']
-            flag_timestamp_parsed = True
-            df_met['doy'] = (
-                df_met['timestamp'] -
-                pd.Timestamp('%d-01-01' %
-                             fetched_data['timestamp'][0].year)) / \
-                pd.Timedelta(days=1)
-            print('Timestamps parsed.')
-
-        df_met[var] = fetched_data[var]
-
-        del url, response, fetched_data
-
-
-# round met variables to '%.6f' except precipitation
-# keep 'precip' as '%.2f'. nothing to be done for it
-# do not round day of year variable 'doy'
-df_met = df_met.round({var: 6 for var in varnames[0:-1]})
-
-# renaming column names in the output dataframe
-for col in df_met.columns.values:
-    if col in renaming_dict:
-        df_met.rename(columns={col: renaming_dict[col]}, inplace=True)
-
-print('Variable fields have been renamed in the output data.')
-
-df_met.to_csv(output_dir + '/hyy16_met_data.csv', na_rep='NaN', index=False)
-print('Tabulated data written to %s/hyy16_met_data.csv' % output_dir)
-
-
-# echo program ending
-dt_end = datetime.datetime.now()
-print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
-print('Done. Finished in %.2f seconds.' % (dt_end - dt_start).total_seconds())
+    # the table is written to a temporary file, which then replaces it, so
+    # that an interrupted run never leaves a truncated table
+    if append_offset is None:
+        df_met.to_csv(output_fname + '.tmp', na_rep='NaN', index=False)
+        os.replace(output_fname + '.tmp', output_fname)
+        print('Tabulated data written to %s' % output_fname)
+    else:
+        # keep the rows before the overlap, replace the overlapping rows, and
+        # append the new ones
+        with open(output_fname, 'rb') as src, \
+                open(output_fname + '.tmp', 'wb') as dst:
+            n_left = append_offset
+            while n_left > 0:
+                block = src.read(min(n_left, 1 << 20))
+                if len(block) == 0:
+                    break
+                dst.write(block)
+                n_left -= len(block)
+        with open(output_fname + '.tmp', 'a') as f:
+            df_met.to_csv(f, na_rep='NaN', index=False, header=False)
+        os.replace(output_fname + '.tmp', output_fname)
+        print('%d rows from %s written to %s' %
+              (df_met.shape[0], fetch_start_dt, output_fname))
+
+    # echo program ending
+    dt_end = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
+    print('Done. Finished in %.2f seconds.' %
+          (dt_end - dt_start).total_seconds())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,13 +19,20 @@ Revision history
 
 """
 import os
+import sys
 import argparse
+import collections
 import datetime
+import multiprocessing
 import warnings
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import preproc_config  # preprocessing config file, in the same directory
+import preproc_grid
+import preproc_io
+import preproc_manifest
+import preproc_parallel
+import preproc_qc
 
 
 def timesec_to_doy(ts_array, year=2016):
@@ -67,137 +74,273 @@ def interp_flow_lsc(day_of_year):
     return flow_interp
 
 
-# define terminal argument parser
-parser = argparse.ArgumentParser(
-    description='Extract, combine, and downsample flow data.')
-parser.add_argument('-s', '--silent', dest='flag_silent_mode',
-                    action='store_true',
-                    help='silent mode: run without printing daily summary')
-args = parser.parse_args()
+def read_flow_file(filepath):
+    """Parse a raw flow data file into an array of `read_csv_options`."""
+    return pd.read_csv(filepath, **read_csv_options).values
 
 
-# echo program starting
-print('Subsetting, gapfilling and downsampling the flow data...')
-dt_start = datetime.datetime.now()
-print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
-print('numpy version = ' + np.__version__)
-print('pandas version = ' + pd.__version__)
-if preproc_config.run_options['plot_flow_data']:
-    print('Plotting option is enabled. Will generate daily plots.')
+def load_flow_file(filepath):
+    """Load a raw flow data file through the binary cache, if enabled."""
+    return preproc_io.load_cached_array(filepath, read_flow_file, cache_dir,
+                                        read_csv_options['names'])
 
 
-# settings
-warnings.simplefilter('ignore', category=RuntimeWarning)
-# suppress the annoying numpy runtime warning of "mean of empty slice"
+def mask_corrupt_flow_data(doy, flow_data):
+    """
+    Mask corrupt flow data by the rules in `preproc_qc.flow_qc_rules`.
 
-pd.options.display.float_format = '{:.2f}'.format
-# let pandas dataframe displays float with 2 decimal places
+    The flow data array (columns 'flow_out' to 'flow_ch_5') is modified in
+    place, over any range of days at once.
+    """
+    flow_qc.apply(doy, flow_data, read_csv_options['names'][1:])
 
-plt.rcParams.update({'mathtext.default': 'regular'})  # sans-serif math
-plt.style.use('ggplot')
 
-flow_dir = preproc_config.data_dir['flow_data_raw']
-output_dir = preproc_config.data_dir['flow_data_reformatted']
+def day_extraction_bounds(doy_sorted, doy_start, doy_end):
+    """
+    Build the index of the interpolation windows for a range of days.
 
+    The window of a day spans whole days, from the day of the last sample
+    before the day starts to the day of the first sample after the day ends.
 
-# load all flow data files
-# pandas.concat + list comprehension is 3-5 times faster than previous for-loop
-flow_flist = [flow_dir + '/data_%d.dat' % i for i in range(40, 340)]
-read_csv_options = {
-    'sep': '\t',
-    'names': ['time_sec', 'flow_out', 'flow_ch_1', 'flow_ch_2',
-              'flow_ch_3', 'flow_ch_4', 'flow_ch_5'],
-    'dtype': np.float64,
-    'engine': 'c',
-    'encoding': 'utf-8',
-    'na_filter': False,
-}
-df_flow_loaded = [pd.read_csv(entry, **read_csv_options)
-                  for entry in flow_flist if os.path.isfile(entry)]
-try:
-    df_flow = pd.concat(df_flow_loaded, ignore_index=True)
-except ValueError:
-    df_flow = None  # if the list to concatenate is empty
+    Parameters
+    ----------
+    doy_sorted : array_like
+        Time-ordered day of year values of the flow data.
+    doy_start, doy_end : int
+        Range of days to process, `doy_end` excluded.
 
-del df_flow_loaded
+    Return
+    ------
+    row_lo, row_hi : array_like
+        Row indices of the start (inclusive) and the end (exclusive) of the
+        window of each day, to slice the flow data directly.
+
+    """
+    n_rows = doy_sorted.size
+    days = np.arange(doy_start, doy_end)
+    # the last sample before the day, and the first sample after the day
+    loc_before = np.searchsorted(doy_sorted, days, side='left') - 1
+    loc_after = np.searchsorted(doy_sorted, days + 1, side='right')
+    doy_lolim_extract = np.where(
+        loc_before >= 0, np.floor(doy_sorted[np.maximum(loc_before, 0)]),
+        doy_start)
+    doy_uplim_extract = np.where(
+        loc_after < n_rows,
+        np.ceil(doy_sorted[np.minimum(loc_after, n_rows - 1)]), doy_end)
+    # floor(doy) >= lolim is doy >= lolim; floor(doy) <= uplim is doy < uplim+1
+    row_lo = np.searchsorted(doy_sorted, doy_lolim_extract, side='left')
+    row_hi = np.searchsorted(doy_sorted, doy_uplim_extract + 1, side='left')
+    return row_lo, row_hi
+
+
+def bin_mean_linear_interp(x_edges, xp, fp):
+    """
+    Average the piecewise linear interpolant of data points over bins.
+
+    The interpolant is integrated analytically over each bin. No extrapolation
+    is allowed: only the part of a bin within the range of `xp` is averaged,
+    and bins entirely outside of it get NaN.
+
+    Parameters
+    ----------
+    x_edges : array_like
+        Increasing bin edges, of size (number of bins + 1).
+    xp : array_like
+        Increasing x-coordinates of the data points.
+    fp : array_like
+        y-coordinates of the data points, same size as `xp`.
 
+    Return
+    ------
+    f_mean : array_like
+        Bin-averaged values of the interpolant.
+
+    """
+    f_mean = np.full(x_edges.size - 1, np.nan)
+    if xp.size < 2:
+        return f_mean
+    # cumulative integral of the interpolant at the data points
+    cum_int = np.concatenate(
+        ([0.], np.cumsum(0.5 * (fp[1:] + fp[:-1]) * np.diff(xp))))
+    # bin edges trimmed to the range of data points; then integrate from xp[0]
+    x_trimmed = np.clip(x_edges, xp[0], xp[-1])
+    loc = np.clip(np.searchsorted(xp, x_trimmed, side='right') - 1,
+                  0, xp.size - 2)
+    f_trimmed = np.interp(x_trimmed, xp, fp)
+    int_trimmed = cum_int[loc] + \
+        0.5 * (fp[loc] + f_trimmed) * (x_trimmed - xp[loc])
+    bin_width = np.diff(x_trimmed)
+    valid_bins = bin_width > 0.
+    f_mean[valid_bins] = \
+        np.diff(int_trimmed)[valid_bins] / bin_width[valid_bins]
+    return f_mean
+
+
+class FlowDataStream(object):
+    """
+    Sliding window over the flow data files, for bounded-memory processing.
 
-# echo flow data status
-if df_flow is None:
-    print('No data file has been found. Program is aborted.')
-    exit(1)
-else:
-    print('%d lines read from flow data.' % df_flow.shape[0])
+    The files are read one at a time in the order given, which must be the
+    time order, as the processing advances day by day. Only the data still
+    needed for the interpolation of the current and the following days are
+    kept in memory, so memory use does not grow with the length of the
+    archive. The windows are the same as those from `day_extraction_bounds`.
 
+    Parameters
+    ----------
+    flist : list of str
+        Paths of the flow data files, in time order.
+    loader : callable
+        Function that loads a flow data file into an array of
+        `read_csv_options` columns.
+    max_workers : int, optional
+        Number of threads to read the next files ahead, concurrently.
+        Default is 1, to read each file only when it is needed.
 
-# convert time variable to day of the year
-doy_flow = timesec_to_doy(df_flow['time_sec'].values)
-doy_int_flow = np.floor(doy_flow).astype(np.int64)
-# integer day of year by floor (equivalent to Julian day number - 1)
+    """
 
+    def __init__(self, flist, loader, max_workers=1):
+        self.flist = list(flist)
+        self.loaded = preproc_parallel.imap_threads(
+            loader, self.flist, max_workers)
+        self.n_files_read = 0
+        self.blocks = []  # (filepath, doy, flow_data) of each file in memory
+
+    def _read_next_file(self):
+        """Read the next file into the window; False if none left."""
+        while self.n_files_read < len(self.flist):
+            filepath = self.flist[self.n_files_read]
+            self.n_files_read += 1
+            data = next(self.loaded)
+            if data.shape[0] == 0:
+                continue
+            doy = timesec_to_doy(np.array(data[:, 0]))
+            flow_data = np.array(data[:, 1:7])  # a writable copy
+            mask_corrupt_flow_data(doy, flow_data)
+            self.blocks.append((filepath, doy, flow_data))
+            return True
+        return False
+
+    def _drop_before(self, doy_lolim):
+        """Drop the files whose data are all before a day boundary."""
+        while len(self.blocks) > 1 and self.blocks[0][1].max() < doy_lolim:
+            del self.blocks[0]
+
+    def window(self, doy):
+        """
+        Get the interpolation window of a day.
+
+        Days must be requested in increasing order.
+
+        Return
+        ------
+        doy_extracted : array_like
+            Day of year values of the window.
+        flow_extracted : array_like
+            Flow data of the window, columns 'flow_out' to 'flow_ch_5'.
+        input_files : list of str
+            Paths of the files with data in the window.
+
+        """
+        # read ahead until the data reach past the day of the first sample
+        # after the day ends; meanwhile, drop the data before the day of the
+        # last sample before the day starts, which no later day needs
+        while True:
+            if self.blocks:
+                doy_loaded = np.concatenate(
+                    [block[1] for block in self.blocks])
+                doy_before = doy_loaded[doy_loaded < doy]
+                if doy_before.size > 0:
+                    self._drop_before(np.floor(doy_before.max()))
+                doy_after = doy_loaded[doy_loaded > doy + 1]
+                if doy_after.size > 0 and \
+                        doy_loaded.max() >= np.ceil(doy_after.min()) + 1:
+                    break
+            if not self._read_next_file():
+                break
+
+        if not self.blocks:
+            return np.zeros(0), np.zeros((0, 6)), []
+
+        doy_window = np.concatenate([block[1] for block in self.blocks])
+        flow_window = np.concatenate([block[2] for block in self.blocks])
+        if np.any(np.diff(doy_window) < 0.):
+            sort_order = np.argsort(doy_window, kind='mergesort')
+            doy_window = doy_window[sort_order]
+            flow_window = flow_window[sort_order]
+        # if no sample is before or after the day, the fallback bounds of
+        # `day_extraction_bounds` include all the data in memory, the same as
+        # when all the data are loaded
+        row_lo, row_hi = day_extraction_bounds(doy_window, doy, doy + 1)
+        row_lo, row_hi = row_lo[0], row_hi[0]
+        input_files = [
+            block[0] for block in self.blocks
+            if row_hi > row_lo and block[1].min() <= doy_window[row_hi - 1]
+            and block[1].max() >= doy_window[row_lo]]
+        return (doy_window[row_lo:row_hi], flow_window[row_lo:row_hi],
+                input_files)
+
+
+def process_flow_day(doy):
+    """
+    Gapfill, downsample, and write the flow data of one day in memory.
 
-# mask seriously negative flow rates on Aug 27 due to power failure
-# otherwise, the interpolation between Aug 27 and 29 would be wrong
-# Note: the transient spikes in flow rates, e.g., on Aug 12 & 15, may be real
-for col in ['flow_ch_1', 'flow_ch_2', 'flow_ch_3']:
-    df_flow.loc[(df_flow[col].values < 0.6) & (doy_int_flow == 239),
-                col] = np.nan
-for col in ['flow_ch_4', 'flow_ch_5']:
-    df_flow.loc[(df_flow[col].values < 1.) & (doy_int_flow == 239),
-                col] = np.nan
+    The loaded flow data (`doy_flow`, `flow_data`) and their day index
+    (`row_lo_flow`, `row_hi_flow`, starting from `doy_start`) are read from
+    the module-level variables, so that forked worker processes share them
+    without pickling. See `process_flow_window` for the return value.
+    """
+    row_lo = row_lo_flow[doy - doy_start]
+    row_hi = row_hi_flow[doy - doy_start]
+    return process_flow_window(doy, doy_flow[row_lo:row_hi],
+                               flow_data[row_lo:row_hi])
 
 
-if preproc_config.run_options['process_recent_period']:
-    doy_start = np.ceil(doy_flow[-1]).astype(np.int64) - \
-        preproc_config.run_options['traceback_in_days']
-else:
-    doy_start = np.floor(doy_flow[0]).astype(np.int64)
+def process_flow_window(doy, doy_extracted, flow_extracted, time_step=60.):
+    """
+    Gapfill, downsample, and write the flow data of one day.
 
-doy_end = np.ceil(doy_flow[-1]).astype(np.int64)
+    Parameters
+    ----------
+    doy : int
+        Day of year number (days since Jan 1 00:00 of the year, floored).
+    doy_extracted : array_like
+        Day of year values of the interpolation window of the day.
+    flow_extracted : array_like
+        Flow data of the interpolation window of the day, columns
+        'flow_out' to 'flow_ch_5'.
+    time_step : float, optional
+        Time step of the downsampled data in seconds, a divisor of 86400.
+        Default is 60 (1 min).
 
+    Return
+    ------
+    summary : str
+        Daily summary of the downsampled flow data, for printing.
+    plot_data : tuple or None
+        Time in hours and the columns of the daily plot, if plotting is
+        enabled; otherwise, None.
 
-# to bin the data by day, gapfill, and downsample to 1 min step
-for doy in range(doy_start, doy_end):
+    """
     run_date_str = (
         datetime.datetime(2016, 1, 1) +
         datetime.timedelta(doy + 0.5)).strftime('%Y%m%d')
-    # gapfilling: to oversample to 0.5 s step and fill by interpolation
+    # gapfilling and downsampling: average the linear interpolant of the flow
+    # data over each time step, in seconds since the start of the day
     # no extrapolation is allowed
-    # note the gapfilled data are in a numpy array for convenience
-    flow_data_gapfilled = np.zeros((24 * 60 * 60 * 2, 7)) * np.nan
-    flow_data_gapfilled[:, 0] = np.arange(0, 86400, 0.5) / 86400. + doy
-    for col_num in range(1, 7):
-        # extract a segment of for interpolation
-        # set the lower bound of the extraction
-        try:
-            doy_lolim_extract = np.int(np.floor(doy_flow[doy_flow < doy][-1]))
-        except IndexError:
-            doy_lolim_extract = doy_start
-        # set the upper bound of the extraction
-        try:
-            doy_uplim_extract = \
-                np.int(np.ceil(doy_flow[doy_flow > doy + 1][0]))
-        except IndexError:
-            doy_uplim_extract = doy_end
-        # extraction index
-        finite_loc = np.where(
-            np.isfinite(df_flow.iloc[:, col_num].values) &
-            (doy_int_flow >= doy_lolim_extract) &
-            (doy_int_flow <= doy_uplim_extract))[0]
-        flow_data_gapfilled[:, col_num] = np.interp(
-            flow_data_gapfilled[:, 0], doy_flow[finite_loc],
-            df_flow.iloc[finite_loc, col_num].values,
-            left=np.nan, right=np.nan)
-    # downsampling to 1 min step
+    n_steps = int(round(86400. / time_step))
+    time_edges = np.arange(n_steps + 1) * time_step
     df_flow_downsampled = pd.DataFrame(
         columns=['doy', 'flow_out', 'flow_ch_1', 'flow_ch_2',
                  'flow_ch_3', 'flow_ch_4', 'flow_ch_5'], dtype=np.float64)
-    df_flow_downsampled['doy'] = (np.arange(1440) + 0.5) / 1440. + doy
-    # use array broadcasting for averaging/downsampling
-    flow_data_downsampled = \
-        np.nanmean(flow_data_gapfilled.reshape(1440, 120, 7), axis=1)
-    # assign downsampled values to the dataframe
-    df_flow_downsampled.iloc[:, 1:7] = flow_data_downsampled[:, 1:7]
+    df_flow_downsampled['doy'] = \
+        (np.arange(n_steps) + 0.5) / (86400. / time_step) + doy
+    time_extracted = (doy_extracted - doy) * 86400.
+    for col_num in range(1, 7):
+        flow_col = flow_extracted[:, col_num - 1]
+        finite_loc = np.where(np.isfinite(flow_col))[0]
+        df_flow_downsampled.iloc[:, col_num] = bin_mean_linear_interp(
+            time_edges, time_extracted[finite_loc], flow_col[finite_loc])
 
     # add `flow_ch_6`, interpolated from manually measured, discrete values
     df_flow_downsampled['flow_ch_6'] = \
@@ -209,45 +352,488 @@ for doy in range(doy_start, doy_end):
         'flow_ch_3': 6, 'flow_ch_4': 6, 'flow_ch_5': 6, 'flow_ch_6': 6})
 
     # dump data into csv files; do not output row index
-    output_fname = output_dir + '/hyy16_flow_data_%s.csv' % run_date_str
-    df_flow_downsampled.to_csv(output_fname, na_rep='NaN', index=False)
+    df_flow_downsampled.to_csv(flow_output_path(doy), na_rep='NaN',
+                               index=False)
+    if flow_cube is not None:
+        flow_cube.write_day(doy, df_flow_downsampled.iloc[:, 1:].values)
+
+    # data of the daily plot for diagnosing wrong measurements, rendered in
+    # the background by the plot pool of the main process
+    if preproc_config.run_options['plot_flow_data']:
+        plot_data = ((df_flow_downsampled['doy'].values - doy) * 24.,
+                     {col: df_flow_downsampled[col].values
+                      for col in df_flow_downsampled.columns.values[1:]})
+    else:
+        plot_data = None
+
+    summary = ('\n%d lines converted from flow data file(s) on the day %s.' %
+               (df_flow_downsampled.shape[0], run_date_str) +
+               '\nDownsampled to %g s step.\n\n' % time_step +
+               str(df_flow_downsampled.describe().transpose()))
+
+    del df_flow_downsampled
+
+    return summary, plot_data
+
+
+def day_key(doy):
+    """Key of a day in the run manifest: its date string 'yymmdd'."""
+    return (datetime.datetime(2016, 1, 1) +
+            datetime.timedelta(doy + 0.5)).strftime('%y%m%d')
+
 
-    # daily plots for diagnosing wrong measurements
+def flow_output_path(doy):
+    """Path of the output file of a day."""
+    return output_dir + '/hyy16_flow_data_%s.csv' % (
+        datetime.datetime(2016, 1, 1) +
+        datetime.timedelta(doy + 0.5)).strftime('%Y%m%d')
+
+
+def flow_file_range(data):
+    """Day of year range [first, last] of a flow data array; None if empty."""
+    if data.shape[0] == 0:
+        return None
+    return timesec_to_doy(np.array([np.min(data[:, 0]),
+                                    np.max(data[:, 0])])).tolist()
+
+
+def window_bounds(doy, doy_window):
+    """
+    Get the bounds of the data that may enter the interpolation window of a
+    day, from the window: from the day of the last sample before the day, to
+    the end of the day of the first sample after it. A bound is None if there
+    is no such sample.
+    """
+    doy_before = doy_window[doy_window < doy]
+    doy_after = doy_window[doy_window > doy + 1]
+    return [float(np.floor(doy_before[-1])) if doy_before.size else None,
+            float(np.ceil(doy_after[0])) + 1. if doy_after.size else None]
+
+
+def window_bounds_from_ranges(doy, doy_ranges):
+    """
+    Get bounds that contain the interpolation window of a day, from the time
+    ranges of the data files only, without reading them; see
+    `window_bounds`.
+    """
+    # the last sample before the day is at or after the end of a file before
+    # the day, or the start of a file that reaches into the day; likewise for
+    # the first sample after the day
+    doy_before = [last if last < doy else first
+                  for first, last in doy_ranges if first < doy]
+    doy_after = [first if first > doy + 1 else last
+                 for first, last in doy_ranges if last > doy + 1]
+    return [float(np.floor(max(doy_before))) if doy_before else None,
+            float(np.ceil(min(doy_after))) + 1. if doy_after else None]
+
+
+def _overlaps(doy_range, bounds):
+    """Check if a day of year range overlaps window bounds."""
+    return (bounds[1] is None or doy_range[0] < bounds[1]) and \
+        (bounds[0] is None or doy_range[1] >= bounds[0])
+
+
+def run_day_range(doy_first, doy_last):
+    """
+    Get the range of days to run, `doy_end` excluded, from the first and the
+    last day of year values of the data: all days, or only the recent period.
+    """
+    if preproc_config.run_options['process_recent_period']:
+        doy_start = np.ceil(doy_last).astype(np.int64) - \
+            preproc_config.run_options['traceback_in_days']
+    else:
+        doy_start = np.floor(doy_first).astype(np.int64)
+    doy_end = np.ceil(doy_last).astype(np.int64)
+    return doy_start, doy_end
+
+
+def resolve_stale_days(days, file_ranges, manifest):
+    """
+    Find the days to process with the run manifest, from the time ranges of
+    the data files, without reading them.
+
+    A day is stale if it is not up to date in the manifest, or if a data file
+    other than its recorded inputs, e.g., a new file, has data within the
+    window bounds recorded for it.
+
+    Parameters
+    ----------
+    days : iterable of int
+        Days to check.
+    file_ranges : dict
+        Day of year ranges [first, last] of the non-empty data files, keyed
+        by file path.
+    manifest : preproc_manifest.RunManifest
+        The run manifest.
+
+    Return
+    ------
+    stale_days : list of int
+        Days to process.
+
+    """
+    stale_days = []
+    for doy in days:
+        inputs = manifest.recorded_inputs(day_key(doy))
+        info = manifest.day_info(day_key(doy))
+        is_up_to_date = \
+            inputs is not None and info is not None and \
+            all(entry in file_ranges for entry in inputs) and \
+            manifest.is_up_to_date(day_key(doy), inputs,
+                                   [flow_output_path(doy)]) and \
+            not any(_overlaps(doy_range, info['window'])
+                    for entry, doy_range in file_ranges.items()
+                    if entry not in inputs)
+        if not is_up_to_date:
+            stale_days.append(doy)
+    return stale_days
+
+
+def iter_flow_day_tasks(days, stream=None, processed=None):
+    """
+    Generate the arguments of the daily processing of flow data.
+
+    With all the data in memory, the argument is the day only, for
+    `process_flow_day`; with a stream, it includes the window of the day, for
+    `process_flow_window`. The processed days are appended to `processed` as
+    (doy, input files, window bounds), in order; see `window_bounds`.
+    """
+    for doy in days:
+        if stream is None:
+            task_args = (doy,)
+            row_lo = row_lo_flow[doy - doy_start]
+            row_hi = row_hi_flow[doy - doy_start]
+            input_files = [
+                entry for entry, doy_range in zip(flow_flist, doy_range_flist)
+                if row_hi > row_lo and doy_range[0] <= doy_flow[row_hi - 1]
+                and doy_range[1] >= doy_flow[row_lo]]
+            doy_window = doy_flow[row_lo:row_hi]
+        else:
+            doy_window, flow_extracted, input_files = stream.window(doy)
+            task_args = (doy, doy_window, flow_extracted)
+        if processed is not None:
+            processed.append((doy, input_files,
+                              window_bounds(doy, doy_window)))
+        yield task_args
+
+
+# layout of the daily plots; see `preproc_plot`
+flow_plot_layout = {
+    'name': 'flow_data',
+    'panels': [
+        {'columns': ['flow_ch_1', 'flow_ch_2', 'flow_ch_3'], 'ncol': 3,
+         'ylabel': 'Leaf chamber flow rate\n(std. L min$^{-1}$)'},
+        {'columns': ['flow_ch_4', 'flow_ch_5', 'flow_ch_6'], 'ncol': 2,
+         'ylabel': 'Soil chamber flow rate\n(std. L min$^{-1}$)'},
+    ],
+    'xlabel': 'Hour (UTC+2)',
+    'xlim': [0, 24],
+    'xticks': range(0, 25, 3),
+}
+
+read_csv_options = {
+    'sep': '\t',
+    'names': ['time_sec', 'flow_out', 'flow_ch_1', 'flow_ch_2',
+              'flow_ch_3', 'flow_ch_4', 'flow_ch_5'],
+    'dtype': np.float64,
+    'engine': 'c',
+    'encoding': 'utf-8',
+    'na_filter': False,
+}
+
+# quality control rules, compiled once for all days
+flow_qc = preproc_qc.QCRuleTable(preproc_qc.flow_qc_rules)
+
+# state of a run, set by `main`; forked worker processes inherit it
+output_dir = None
+cache_dir = None
+flow_flist = []
+doy_range_flist = []
+doy_flow = None
+flow_data = None
+doy_start = None
+row_lo_flow = None
+row_hi_flow = None
+flow_cube = None
+
+
+def main(argv=None):
+    """
+    Run the flow data preprocessing.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. Default is None, for `sys.argv[1:]`.
+
+    Return
+    ------
+    status : int
+        Exit status: 0 on success.
+
+    """
+    global output_dir, cache_dir, flow_flist, doy_range_flist, doy_flow, \
+        flow_data, doy_start, row_lo_flow, row_hi_flow, flow_cube
+
+    # define terminal argument parser
+    parser = argparse.ArgumentParser(
+        description='Extract, combine, and downsample flow data.')
+    parser.add_argument('-s', '--silent', dest='flag_silent_mode',
+                        action='store_true',
+                        help='silent mode: run without printing daily summary')
+    parser.add_argument('-j', '--jobs', dest='n_jobs', type=int, default=1,
+                        help='number of worker processes for the daily loop')
+    parser.add_argument('--stream', dest='flag_stream', action='store_true',
+                        help='stream the data files in a sliding window ' +
+                        'instead of loading them all, to bound memory use')
+    args = parser.parse_args(argv)
+
+    # echo program starting
+    print('Subsetting, gapfilling and downsampling the flow data...')
+    dt_start = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
+    print('numpy version = ' + np.__version__)
+    print('pandas version = ' + pd.__version__)
+    if preproc_config.run_options['plot_flow_data']:
+        print('Plotting option is enabled. Will generate daily plots.')
+
+    # settings
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+    # suppress the annoying numpy runtime warning of "mean of empty slice"
+
+    pd.options.display.float_format = '{:.2f}'.format
+    # let pandas dataframe displays float with 2 decimal places
+
+    if preproc_config.run_options['plot_flow_data']:
+        # matplotlib is imported only to plot; forked plot workers inherit the
+        # style settings
+        import matplotlib.pyplot as plt
+        plt.rcParams.update({'mathtext.default': 'regular'})  # sans-serif math
+        plt.style.use('ggplot')
+
+    flow_dir = preproc_config.data_dir['flow_data_raw']
+    output_dir = preproc_config.data_dir['flow_data_reformatted']
+    cache_dir = preproc_config.data_dir.get('flow_data_cache')
+
+    # list flow data files, in time order by file number
+    flow_flist = [flow_dir + '/data_%d.dat' % i for i in range(40, 340)]
+    flow_flist = [entry for entry in flow_flist if os.path.isfile(entry)]
+    if len(flow_flist) == 0:
+        print('No data file has been found. Program is aborted.')
+        return 1
+
+    # with the run manifest, skip the days whose input files, config and code
+    # are unchanged since their output was written
+    if preproc_config.run_options['use_run_manifest']:
+        manifest = preproc_manifest.RunManifest(
+            output_dir + '/hyy16_flow_data_manifest.json',
+            preproc_manifest.config_digest({
+                'flow_data_reformatted': output_dir,
+                'plot_flow_data': preproc_config.run_options['plot_flow_data'],
+                'write_data_cube':
+                preproc_config.run_options['write_data_cube']}),
+            preproc_manifest.code_digest(__file__, preproc_grid.__file__,
+                                         preproc_qc.__file__))
+    else:
+        manifest = None
+
+    # optional output of all days in a single memory-mapped array file; it is
+    # grown to the range of days before any worker process is forked
+    if preproc_config.run_options['write_data_cube']:
+        flow_cube = preproc_grid.GridCube(
+            output_dir + '/hyy16_flow_data_cube',
+            ['flow_out', 'flow_ch_1', 'flow_ch_2', 'flow_ch_3', 'flow_ch_4',
+             'flow_ch_5', 'flow_ch_6'], 60., sample_offset=30.)
+    else:
+        flow_cube = None
+
+    # with the manifest, the days to run are found before reading the data,
+    # from the time ranges of the files: those of unchanged files are recorded
+    # in the manifest, and only new or modified files are read here
+    preloaded = {}  # data read here, to be reused by the loading below
+    if manifest is not None:
+        file_ranges = collections.OrderedDict()
+        for entry in flow_flist:
+            record = manifest.file_info(entry)
+            if record is None:
+                data = load_flow_file(entry)[0]
+                record = {'doy_range': flow_file_range(data)}
+                manifest.record_file(entry, record)
+                if not args.flag_stream and record['doy_range'] is not None:
+                    preloaded[entry] = data
+                del data
+            if record['doy_range'] is not None:
+                file_ranges[entry] = record['doy_range']
+        if len(file_ranges) == 0:
+            print('No data file has data. Program is aborted.')
+            return 1
+        doy_first = min(doy_range[0] for doy_range in file_ranges.values())
+        doy_last = max(doy_range[1] for doy_range in file_ranges.values())
+    elif args.flag_stream:
+        # files are read as the days advance; only the range of days is needed
+        # now, from the first and the last non-empty files, which are kept for
+        # the stream instead of being read again
+        for entry in flow_flist:
+            preloaded[entry] = load_flow_file(entry)[0]
+            if preloaded[entry].shape[0] > 0:
+                doy_first = flow_file_range(preloaded[entry])[0]
+                break
+        else:
+            print('No data file has data. Program is aborted.')
+            return 1
+        for entry in reversed(flow_flist):
+            if entry not in preloaded:
+                preloaded[entry] = load_flow_file(entry)[0]
+            if preloaded[entry].shape[0] > 0:
+                doy_last = flow_file_range(preloaded[entry])[1]
+                break
+    else:
+        doy_first = doy_last = None  # from the data loaded below
+
+    load_flist = flow_flist
+    if doy_first is not None:
+        doy_start, doy_end = run_day_range(doy_first, doy_last)
+        days = list(range(doy_start, doy_end))
+        if manifest is not None:
+            # days new to the cube must be processed again, even if their CSV
+            # outputs are up to date
+            if flow_cube is not None:
+                flow_cube.ensure_days(doy_start, doy_end)
+                for doy in flow_cube.added_days:
+                    manifest.discard(day_key(doy))
+            days = resolve_stale_days(days, file_ranges, manifest)
+            # only the files with data in the windows of the stale days
+            day_bounds = [window_bounds_from_ranges(
+                doy, list(file_ranges.values())) for doy in days]
+            load_flist = [
+                entry for entry, doy_range in file_ranges.items()
+                if any(_overlaps(doy_range, bounds) for bounds in day_bounds)]
+
+    if args.flag_stream:
+        flow_stream = FlowDataStream(
+            load_flist,
+            lambda entry: preloaded.pop(entry) if entry in preloaded
+            else load_flow_file(entry)[0],
+            preproc_config.run_options['io_workers'])
+        print('%d data file(s) to be read in streaming mode.' %
+              len(load_flist))
+    elif len(load_flist) > 0:
+        # load the flow data files, concurrently in a thread pool
+        # parsed files are cached as binary arrays; only new or modified files
+        # are read
+        flow_stream = None
+        flow_data_loaded = preproc_io.read_files(
+            load_flist,
+            lambda entry: (preloaded.pop(entry), False)
+            if entry in preloaded else load_flow_file(entry),
+            preproc_config.run_options['io_workers'])
+        preloaded.clear()
+        # time range covered by each file, to find the input files of each day
+        flow_flist, doy_range_flist = [], []
+        for entry, (data, _) in zip(load_flist, flow_data_loaded):
+            if data.shape[0] > 0:
+                flow_flist.append(entry)
+                doy_range_flist.append(flow_file_range(data))
+        n_files_cached = sum(is_cached for _, is_cached in flow_data_loaded)
+        flow_data = np.concatenate([data for data, _ in flow_data_loaded])
+        del flow_data_loaded
+        if flow_data.shape[0] == 0:
+            print('No data file has data. Program is aborted.')
+            return 1
+
+        # echo flow data status
+        print('%d lines read from flow data.' % flow_data.shape[0])
+        if cache_dir is not None:
+            print('%d data file(s) loaded from the cache.' % n_files_cached)
+
+        # convert time variable to day of the year
+        doy_flow = timesec_to_doy(flow_data[:, 0])
+        flow_data = flow_data[:, 1:7]
+        # the day index relies on time-ordered data; sort only if files overlap
+        if np.any(np.diff(doy_flow) < 0.):
+            sort_order = np.argsort(doy_flow, kind='mergesort')
+            doy_flow = doy_flow[sort_order]
+            flow_data = flow_data[sort_order]
+            del sort_order
+
+        mask_corrupt_flow_data(doy_flow, flow_data)
+    else:
+        flow_stream = None  # no stale day; nothing to read
+
+    if doy_first is None:
+        # the range of days from all the loaded data
+        doy_start, doy_end = run_day_range(doy_flow[0], doy_flow[-1])
+        days = list(range(doy_start, doy_end))
+
+    if flow_stream is None and len(days) > 0:
+        # one-time index of the interpolation window of each day
+        row_lo_flow, row_hi_flow = day_extraction_bounds(
+            doy_flow, doy_start, doy_end)
+
+    if flow_cube is not None:
+        flow_cube.ensure_days(doy_start, doy_end)
+
+    # to bin the data by day, gapfill, and downsample to 1 min step
+    # each day is independent of the others, so the days can be farmed out to a
+    # pool of worker processes; the workers are forked after the flow data are
+    # loaded and inherit `doy_flow` and `flow_data` read-only without pickling;
+    # in streaming mode, only the window of each day is sent to the workers
+    if args.n_jobs > 1:
+        pool = multiprocessing.get_context('fork').Pool(args.n_jobs)
+    else:
+        pool = None
+
+    # daily plots are rendered in the background by a separate pool of worker
+    # processes, which reuse their figures, so that processing never waits for
+    # rendering
     if preproc_config.run_options['plot_flow_data']:
-        fig, axes = plt.subplots(2, 1, sharex=True)
-        time_in_hour = (df_flow_downsampled['doy'].values - doy) * 24.
-        for col in ['flow_ch_1', 'flow_ch_2', 'flow_ch_3']:
-            axes[0].plot(time_in_hour, df_flow_downsampled[col].values,
-                         label=col, lw=1.)
-        axes[0].legend(loc='upper left', frameon=False, fontsize=10, ncol=3)
-
-        for col in ['flow_ch_4', 'flow_ch_5', 'flow_ch_6']:
-            axes[1].plot(time_in_hour, df_flow_downsampled[col].values,
-                         label=col, lw=1.)
-        axes[1].legend(loc='upper left', frameon=False, fontsize=10, ncol=2)
-
-        axes[0].set_ylabel('Leaf chamber flow rate\n(std. L min$^{-1}$)')
-        axes[1].set_ylabel('Soil chamber flow rate\n(std. L min$^{-1}$)')
-        axes[1].set_xlim([0, 24])
-        axes[1].xaxis.set_ticks(range(0, 25, 3))
-        axes[1].set_xlabel('Hour (UTC+2)')
-
-        fig.tight_layout()
-        fig.savefig(output_dir +
-                    '/plots/hyy16_flow_data_%s.png' % run_date_str)
-        fig.clf()
-        del fig, axes
-
-    if not args.flag_silent_mode:
-        print('\n%d lines converted from flow data file(s) on the day %s.' %
-              (df_flow_downsampled.shape[0], run_date_str) +
-              '\nDownsampled to 1 min step.\n')
-        print(df_flow_downsampled.describe().transpose())
-
-    del flow_data_gapfilled, df_flow_downsampled
-
-
-# echo program ending
-dt_end = datetime.datetime.now()
-print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
-print('Done. Finished in %.2f seconds.' % (dt_end - dt_start).total_seconds())
+        import preproc_plot
+        plot_pool = preproc_plot.PlotPool(
+            preproc_config.run_options['plot_workers'])
+    else:
+        plot_pool = None
+
+    processed_days = collections.deque()
+    day_summaries = preproc_parallel.imap_bounded(
+        pool, process_flow_day if flow_stream is None else process_flow_window,
+        iter_flow_day_tasks(days, flow_stream, processed_days),
+        2 * args.n_jobs)
+
+    # daily summaries are printed by the main process in the order of days
+    n_days_processed = 0
+    for summary, plot_data in day_summaries:
+        doy, input_files, bounds = processed_days.popleft()
+        n_days_processed += 1
+        if not args.flag_silent_mode:
+            print(summary)
+        if plot_data is not None:
+            plot_pool.submit(
+                flow_plot_layout, plot_data[0], plot_data[1],
+                output_dir + '/plots/hyy16_flow_data_%s.png' %
+                (datetime.datetime(2016, 1, 1) +
+                 datetime.timedelta(doy + 0.5)).strftime('%Y%m%d'))
+        if manifest is not None:
+            manifest.update(day_key(doy), input_files, {'window': bounds})
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if plot_pool is not None:
+        plot_pool.close()
+
+    if manifest is not None:
+        manifest.save()
+        print('%d day(s) skipped with unchanged inputs.' %
+              (doy_end - doy_start - n_days_processed))
+
+    # echo program ending
+    dt_end = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
+    print('Done. Finished in %.2f seconds.' %
+          (dt_end - dt_start).total_seconds())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Run the preprocessing scripts as one pipeline.
+
+Hyytiälä COS campaign, April-November 2016
+
+The stages are the `hyy16_*` scripts, with the dependencies among them. Each
+stage runs in its own process, with its output to a log file, as soon as the
+stages it requires have finished, so that independent stages run
+concurrently. A stage is skipped if its input files, the configuration and the
+code are unchanged since its last successful run, and its outputs exist.
+
+A stage is a dict with the keys
+
+| key        | value                                                        |
+|------------|--------------------------------------------------------------|
+| 'name'     | name of the stage                                            |
+| 'module'   | the script module, run by its `main(argv)`                   |
+| 'requires' | names of the stages that must finish before it               |
+| 'inputs'   | function that lists the input files; of a downstream stage,  |
+|            | these include the outputs of the stages it requires          |
+| 'outputs'  | function that lists the output files, to check that they     |
+|            | exist before a stage is skipped                              |
+
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import datetime
+import multiprocessing
+import multiprocessing.connection
+import preproc_config  # preprocessing config file, in the same directory
+import preproc_io
+import preproc_manifest
+import hyy16_fetch_smear_data
+import hyy16_flow_data
+import hyy16_leaf_area
+import hyy16_sensor_data
+
+
+def _data_files(key, *patterns):
+    """List the files in a directory of `data_dir` by glob patterns."""
+    return sorted(filepath for pattern in patterns for filepath in glob.glob(
+        os.path.join(preproc_config.data_dir[key], pattern)))
+
+
+stages = [
+    {'name': 'fetch', 'module': hyy16_fetch_smear_data, 'requires': [],
+     'inputs': lambda: [],
+     'outputs': lambda: _data_files('met_data', 'hyy16_met_data.csv')},
+    {'name': 'flow', 'module': hyy16_flow_data, 'requires': [],
+     'inputs': lambda: _data_files('flow_data_raw', 'data_*.dat'),
+     'outputs': lambda: _data_files('flow_data_reformatted',
+                                    'hyy16_flow_data_*.csv')},
+    {'name': 'sensor', 'module': hyy16_sensor_data, 'requires': [],
+     'inputs': lambda: _data_files('sensor_data_raw', 'sm_cop/*.cop',
+                                   'sm_mpr/*.mpr'),
+     'outputs': lambda: _data_files('sensor_data_reformatted',
+                                    'hyy16_sensor_data_*.csv')},
+    {'name': 'leaf_area', 'module': hyy16_leaf_area, 'requires': [],
+     'inputs': lambda: _data_files('leaf_area_data_raw',
+                                   'chamber_metadata.csv',
+                                   'aspen_leaf_area_*.csv'),
+     'outputs': lambda: _data_files('leaf_area_data_reformatted',
+                                    'leaf_area.csv')},
+]
+
+
+def stage_digest(stage, argv):
+    """
+    Get the hash of the inputs of a stage: its arguments, the configuration,
+    the code of the script and its `preproc_*` modules, and the size and the
+    modification time of its input files.
+    """
+    module = stage['module']
+    code_files = [module.__file__] + sorted(
+        value.__file__ for name, value in vars(module).items()
+        if name.startswith('preproc_') and hasattr(value, '__file__'))
+    return preproc_manifest.config_digest({
+        'argv': argv,
+        'data_dir': preproc_config.data_dir,
+        'run_options': preproc_config.run_options,
+        'code': preproc_manifest.code_digest(*code_files),
+        'inputs': {filepath: preproc_io.file_signature(filepath)
+                   for filepath in stage['inputs']()},
+    })
+
+
+def _run_stage(module, argv, log_path):
+    """Run the main function of a stage script, with its output to a log."""
+    with open(log_path, 'w') as log_file:
+        # also redirects the output of the worker processes of the stage
+        os.dup2(log_file.fileno(), sys.stdout.fileno())
+        os.dup2(log_file.fileno(), sys.stderr.fileno())
+    sys.exit(module.main(argv))
+
+
+def run_stages(stages, stage_argv, log_dir, last_digests, force=False,
+               max_parallel=None, volatile=()):
+    """
+    Run the pipeline stages in the order of their dependencies.
+
+    Parameters
+    ----------
+    stages : list of dict
+        Stages to run; see the module docstring for the keys. Required stages
+        not in the list are taken as finished.
+    stage_argv : dict
+        Arguments of the stages, keyed by stage name.
+    log_dir : str
+        Directory of the log files of the stages.
+    last_digests : dict
+        Input hashes of the last successful runs, keyed by stage name; see
+        `stage_digest`. Updated in place for the stages that succeed.
+    force : bool, optional
+        Run all stages even if unchanged. Default is False.
+    max_parallel : int, optional
+        Maximum number of stages running at a time. Default is all.
+    volatile : sequence of str, optional
+        Names of the stages that are never skipped, e.g., whose inputs are
+        remote. Default is none.
+
+    Return
+    ------
+    results : dict
+        `(status, wall_time)` of the stages, keyed by stage name. The status
+        is 'done', 'skipped', 'failed (exit code N)', or 'not run' if a
+        required stage failed. The wall time is None if not run.
+
+    """
+    ctx = multiprocessing.get_context('fork')
+    names = [stage['name'] for stage in stages]
+    pending = list(stages)
+    running = {}  # sentinel: (stage, process, start time, input hash)
+    results = {}
+    max_parallel = max_parallel or len(stages)
+
+    def is_finished(name):
+        return name not in names or name in results
+
+    while pending or running:
+        n_finished = len(results)
+        # start the stages whose required stages have all finished
+        for stage in list(pending):
+            if len(running) >= max_parallel:
+                break
+            if not all(is_finished(name) for name in stage['requires']):
+                continue
+            pending.remove(stage)
+            name = stage['name']
+            if any(results.get(req, ('done',))[0] not in ('done', 'skipped')
+                   for req in stage['requires']):
+                results[name] = ('not run', None)
+                print('[%s] not run: a required stage has failed.' % name)
+                continue
+            digest = stage_digest(stage, stage_argv[name])
+            if not force and name not in volatile and \
+                    last_digests.get(name) == digest and \
+                    len(stage['outputs']()) > 0:
+                results[name] = ('skipped', None)
+                print('[%s] skipped: inputs, config and code unchanged.' %
+                      name)
+                continue
+            log_path = os.path.join(log_dir, '%s.log' % name)
+            print('[%s] started, log: %s' % (name, log_path))
+            sys.stdout.flush()  # not to be copied into the forked process
+            sys.stderr.flush()
+            process = ctx.Process(target=_run_stage, args=(
+                stage['module'], stage_argv[name], log_path))
+            process.start()
+            running[process.sentinel] = (stage, process, time.time(), digest)
+        if not running:
+            if pending and len(results) == n_finished:
+                raise ValueError('Circular or unknown stage dependencies: ' +
+                                 ', '.join(stage['name'] for stage in pending))
+            continue
+
+        # wait for any running stage to finish
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            stage, process, time_start, digest = running.pop(sentinel)
+            process.join()
+            wall_time = time.time() - time_start
+            if process.exitcode == 0:
+                results[stage['name']] = ('done', wall_time)
+                last_digests[stage['name']] = digest
+            else:
+                results[stage['name']] = (
+                    'failed (exit code %d)' % process.exitcode, wall_time)
+            print('[%s] %s in %.2f seconds.' %
+                  (stage['name'], results[stage['name']][0], wall_time))
+    return results
+
+
+def main(argv=None):
+    """
+    Run the preprocessing pipeline.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. Default is None, for `sys.argv[1:]`.
+
+    Return
+    ------
+    status : int
+        Exit status: 0 if no stage has failed.
+
+    """
+    # define terminal argument parser
+    parser = argparse.ArgumentParser(
+        description='Run the preprocessing scripts as one pipeline.')
+    parser.add_argument('stages', nargs='*', metavar='STAGE',
+                        help='stages to run: ' +
+                        ', '.join(stage['name'] for stage in stages) +
+                        '; default is all')
+    parser.add_argument('-n', '--now', dest='flag_now', action='store_true',
+                        help='append the SMEAR data till now')
+    parser.add_argument('-j', '--jobs', dest='n_jobs', type=int, default=1,
+                        help='number of worker processes of the flow and ' +
+                        'the sensor stages')
+    parser.add_argument('-p', '--parallel', dest='max_parallel', type=int,
+                        default=None,
+                        help='maximum number of stages running at a time')
+    parser.add_argument('-f', '--force', dest='flag_force',
+                        action='store_true',
+                        help='run the stages even if unchanged')
+    parser.add_argument('-u', '--url', dest='base_url', default=None,
+                        help='URL of the SMEAR API, for the fetch stage')
+    args = parser.parse_args(argv)
+
+    stage_names = [stage['name'] for stage in stages]
+    for name in args.stages:
+        if name not in stage_names:
+            parser.error('unknown stage: %s' % name)
+    selected = [stage for stage in stages
+                if not args.stages or stage['name'] in args.stages]
+
+    # echo program starting
+    print('Running the preprocessing pipeline...')
+    dt_start = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
+
+    fetch_argv = ['-n', '-a'] if args.flag_now else []
+    if args.base_url is not None:
+        fetch_argv += ['-u', args.base_url]
+    stage_argv = {
+        'fetch': fetch_argv,
+        'flow': ['-j', str(args.n_jobs)],
+        'sensor': ['-j', str(args.n_jobs)],
+        'leaf_area': [],
+    }
+
+    # input hashes of the last successful run of each stage
+    log_dir = preproc_config.data_dir['pipeline']
+    os.makedirs(log_dir, exist_ok=True)
+    state_path = os.path.join(log_dir, 'pipeline_state.json')
+    try:
+        with open(state_path, 'r') as f:
+            last_digests = json.load(f)
+    except (IOError, OSError, ValueError):
+        last_digests = {}
+
+    results = run_stages(selected, stage_argv, log_dir, last_digests,
+                         args.flag_force, args.max_parallel,
+                         volatile=['fetch'] if args.flag_now else [])
+
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(last_digests, f, indent=1, sort_keys=True)
+    os.replace(state_path + '.tmp', state_path)
+
+    # per-stage wall time
+    dt_end = datetime.datetime.now()
+    print('\n%-12s%-24s%s' % ('Stage', 'Status', 'Wall time (s)'))
+    for stage in selected:
+        status, wall_time = results[stage['name']]
+        print('%-12s%-24s%s' % (stage['name'], status,
+                                '-' if wall_time is None else
+                                '%.2f' % wall_time))
+    print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
+    print('Done. Finished in %.2f seconds.' %
+          (dt_end - dt_start).total_seconds())
+    return int(any(status not in ('done', 'skipped')
+                   for status, _ in results.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,13 +23,18 @@ Revision history
 - Daily plot option added, which is controlled by the preprocessing config
 
 """
+import sys
 import argparse
-import glob
 import datetime
+import multiprocessing
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import preproc_config  # preprocessing config file, in the same directory
+import preproc_grid
+import preproc_io
+import preproc_manifest
+import preproc_parallel
+import preproc_qc
 
 
 def IQR_bounds_func(x):
@@ -42,125 +47,95 @@ def IQR_bounds_func(x):
         return(np.nan, np.nan)
 
 
-# define terminal argument parser
-parser = argparse.ArgumentParser(
-    description='Extract, combine, and correct chamber sensor data.')
-parser.add_argument('-s', '--silent', dest='flag_silent_mode',
-                    action='store_true',
-                    help='silent mode: run without printing daily summary')
-args = parser.parse_args()
-
-
-# echo program starting
-print('Subsetting, gapfilling and downsampling the biomet sensor data...')
-dt_start = datetime.datetime.now()
-print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
-print('numpy version = ' + np.__version__)
-print('pandas version = ' + pd.__version__)
-if preproc_config.run_options['plot_sensor_data']:
-    print('Plotting option is enabled. Will generate daily plots.')
-
-
-# settings
-pd.options.display.float_format = '{:.2f}'.format
-# let pandas dataframe displays float with 2 decimal places
-
-plt.rcParams.update({'mathtext.default': 'regular'})  # sans-serif math
-plt.style.use('ggplot')
-
-sensor_dir = preproc_config.data_dir['sensor_data_raw']
-output_dir = preproc_config.data_dir['sensor_data_reformatted']
-
-
-# get file list of sensor data
-lc_sensor_flist = glob.glob(
-    sensor_dir + '/sm_cop/*.cop')  # leaf chamber sensors
-sc_sensor_flist = glob.glob(
-    sensor_dir + '/sm_mpr/*.mpr')  # soil chamber sensors
-
-
-# local time is UTC+2
-doy_today = (datetime.datetime.utcnow() -
-             datetime.datetime(2016, 1, 1)).total_seconds() / 86400. + 2. / 24.
-
-if preproc_config.run_options['process_recent_period']:
-    doy_start = np.int(doy_today -
-                       preproc_config.run_options['traceback_in_days'])
-    doy_end = np.int(np.ceil(doy_today))
-else:
-    doy_start = 97  # campaign starts on 7 Apr 2016
-    doy_end = 315  # campaign ends on 10 Nov 2016 (plus one for `range()`)
-
-year_start = 2016  # starting year for converting day of year values
-
-# data fields in the leaf chamber sensor data file (*.cop)
-# correspondence between chamber number and sensor number was changing
-# throughout the campaign. refer to the metadata table for the information.
-# 0 - time; 1 - PAR_ch_1; 2 - PAR_ch_2;
-# 8 - ambient T; 10 - T_ch_1;
-# 11 - T_ch_2; 12 - T_ch_3;
-
-# data fields in the soil chamber sensor data file (*.mpr)
-# 0 - time; 5 - soil chamber 1 (T_ch_4); 6 - soil chamber 2 (T_ch_5)
-# 7 - soil chamber 3 (T_ch_6)
-for doy in range(doy_start, doy_end):
-    run_date_str = (datetime.datetime(2016, 1, 1) +
-                    datetime.timedelta(doy + 0.5)).strftime('%y%m%d')
-    current_lc_sensor_files = [s for s in lc_sensor_flist if run_date_str in s]
-    current_sc_sensor_files = [s for s in sc_sensor_flist if run_date_str in s]
-
-    # reading leaf chamber sensor data
+def read_lc_sensor_file(filepath):
+    """Read a leaf chamber sensor data file (*.cop)."""
+    df_lc_sensor = pd.read_csv(
+        filepath, sep='\\s+', usecols=[0, 1, 2, 8, 10, 11, 12],
+        names=['datetime', 'PAR_ch_1', 'PAR_ch_2', 'T_amb',
+               'T_ch_1', 'T_ch_2', 'T_ch_3'],
+        dtype={'datetime': str, 'PAR_ch_1': np.float64,
+               'PAR_ch_2': np.float64, 'T_amb': np.float64,
+               'T_ch_1': np.float64, 'T_ch_2': np.float64,
+               'T_ch_3': np.float64},
+        engine='c', na_values='-')
+    df_lc_sensor.insert(0, 'timestamp', preproc_io.parse_timestamp_digits(
+        df_lc_sensor.pop('datetime').values))
+    return df_lc_sensor
+
+
+def read_sc_sensor_file(filepath):
+    """Read a soil chamber sensor data file (*.mpr)."""
+    df_sc_sensor = pd.read_csv(
+        filepath, sep='\\s+', usecols=[0, 5, 6, 7],
+        names=['datetime', 'T_ch_4', 'T_ch_5', 'T_ch_6'],
+        dtype={'datetime': str, 'T_ch_4': np.float64,
+               'T_ch_5': np.float64, 'T_ch_6': np.float64},
+        engine='c')
+    df_sc_sensor.insert(0, 'timestamp', preproc_io.parse_timestamp_digits(
+        df_sc_sensor.pop('datetime').values))
+    return df_sc_sensor
+
+
+def read_sensor_files(lc_sensor_files, sc_sensor_files):
+    """
+    Read and concatenate the leaf and soil chamber sensor data files of a day.
+
+    Return
+    ------
+    df_lc_sensor, df_sc_sensor : pandas.DataFrame or None
+        Leaf and soil chamber sensor data, in the order of the files. None if
+        there is no file.
+
+    """
     df_lc_sensor = None
-    if len(current_lc_sensor_files) > 0:
-        for entry in current_lc_sensor_files:
-            df_lc_sensor_loaded = pd.read_csv(
-                entry, sep='\\s+', usecols=[0, 1, 2, 8, 10, 11, 12],
-                names=['datetime', 'PAR_ch_1', 'PAR_ch_2', 'T_amb',
-                       'T_ch_1', 'T_ch_2', 'T_ch_3'],
-                dtype={'datetime': str, 'PAR_ch_1': np.float64,
-                       'PAR_ch_2': np.float64, 'T_amb': np.float64,
-                       'T_ch_1': np.float64, 'T_ch_2': np.float64,
-                       'T_ch_3': np.float64},
-                parse_dates={'timestamp': [0]},
-                date_parser=lambda s: np.datetime64(
-                    '%s-%s-%s %s:%s:%s' % (s[0:4], s[4:6], s[6:8],
-                                           s[8:10], s[10:12], s[12:14])),
-                engine='c', na_values='-')
-            if df_lc_sensor is None:
-                df_lc_sensor = df_lc_sensor_loaded
-            else:
-                df_lc_sensor = pd.concat([df_lc_sensor, df_lc_sensor_loaded],
-                                         ignore_index=True)
-            del df_lc_sensor_loaded
-    else:
-        print('Leaf chamber sensor data file not found on day 20%s' %
-              run_date_str)
-        continue
-
-    # reading soil chamber sensor data
+    if len(lc_sensor_files) > 0:
+        df_lc_sensor = pd.concat(
+            preproc_io.read_files(lc_sensor_files, read_lc_sensor_file),
+            ignore_index=True)
     df_sc_sensor = None
-    if len(current_sc_sensor_files) > 0:
-        for entry in current_sc_sensor_files:
-            df_sc_sensor_loaded = pd.read_csv(
-                entry, sep='\\s+', usecols=[0, 5, 6, 7],
-                names=['datetime', 'T_ch_4', 'T_ch_5', 'T_ch_6'],
-                dtype={'datetime': str, 'T_ch_4': np.float64,
-                       'T_ch_5': np.float64, 'T_ch_6': np.float64},
-                parse_dates={'timestamp': [0]},
-                date_parser=lambda s: np.datetime64(
-                    '%s-%s-%s %s:%s:%s' % (s[0:4], s[4:6], s[6:8],
-                                           s[8:10], s[10:12], s[12:14])),
-                engine='c')
-            if df_sc_sensor is None:
-                df_sc_sensor = df_sc_sensor_loaded
-            else:
-                df_sc_sensor = pd.concat([df_sc_sensor, df_sc_sensor_loaded],
-                                         ignore_index=True)
-            del df_sc_sensor_loaded
-    else:
-        print('Soil chamber sensor data file not found on day 20%s' %
-              run_date_str)
-        continue
+    if len(sc_sensor_files) > 0:
+        df_sc_sensor = pd.concat(
+            preproc_io.read_files(sc_sensor_files, read_sc_sensor_file),
+            ignore_index=True)
+    return df_lc_sensor, df_sc_sensor
+
+
+def process_sensor_day(doy, run_date_str, df_lc_sensor, df_sc_sensor):
+    """
+    Correct, filter, grid, and write the sensor data of one day.
+
+    Parameters
+    ----------
+    doy : int
+        Day of year number (days since Jan 1 00:00 of the year, floored).
+    run_date_str : str
+        Date of the day, 'yymmdd'.
+    df_lc_sensor, df_sc_sensor : pandas.DataFrame or None
+        Leaf and soil chamber sensor data of the day; None if not found.
+
+    Return
+    ------
+    is_processed : bool
+        False if the sensor data of the day are not found.
+    summary : str
+        Daily summary of the sensor data for printing, or the message of
+        missing data files.
+    grid_report : str
+        Counts of the samples dropped or merged in the 5-second grid, if
+        any; otherwise, an empty string.
+    plot_data : tuple or None
+        Time in hours and the columns of the daily plot, if plotting is
+        enabled; otherwise, None.
+
+    """
+    if df_lc_sensor is None:
+        return False, ('Leaf chamber sensor data file not found on day 20%s' %
+                       run_date_str), '', None
+    if df_sc_sensor is None:
+        return False, ('Soil chamber sensor data file not found on day 20%s' %
+                       run_date_str), '', None
+
+    output_fname = output_dir + '/hyy16_sensor_data_20%s.csv' % run_date_str
 
     # convert day of year number
     doy_lc_sensor = \
@@ -186,8 +161,7 @@ for doy in range(doy_start, doy_end):
     #         doy_lc_sensor[i] = np.nan
 
     # indices for insertion, range 0 to 17279
-    ind_lc_sensor = (doy_lc_sensor - doy) * 86400. / 5.
-    ind_lc_sensor = np.round(ind_lc_sensor).astype(np.int64)
+    ind_lc_sensor = preproc_grid.grid_indices(doy_lc_sensor, doy, 5.)
 
     # convert day of year number
     doy_sc_sensor = \
@@ -212,8 +186,7 @@ for doy in range(doy_start, doy_end):
     #         doy_sc_sensor[i] = np.nan
 
     # indices for insertion, range 0 to 17279
-    ind_sc_sensor = (doy_sc_sensor - doy) * 86400. / 5.
-    ind_sc_sensor = np.round(ind_sc_sensor).astype(np.int64)
+    ind_sc_sensor = preproc_grid.grid_indices(doy_sc_sensor, doy, 5.)
 
     # corrections for PAR and TC values
     # parameters from Juho Aalto <juho.aalto@helsinki.fi>, 13 April 2016
@@ -231,105 +204,65 @@ for doy in range(doy_start, doy_end):
         # before that, temperature data were corrupt at this channel
         df_lc_sensor['T_ch_3'] = df_lc_sensor['T_ch_3'] * 0.97 - 0.39
 
-    # mask corrupt data
-    # 1. 'T_ch_3' data between April 8 and 13 of 2016 were corrupt
-    if doy == 98:
-        break_pt = (datetime.datetime(2016, 4, 8, 9, 33, 41) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[doy_lc_sensor > break_pt, 'T_ch_3'] = np.nan
-        del break_pt
-    elif 98 < doy < 103:
-        df_lc_sensor['T_ch_3'] = np.nan
-    elif doy == 103:
-        break_pt = (datetime.datetime(2016, 4, 13, 11, 20, 24) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[doy_lc_sensor < break_pt, 'T_ch_3'] = np.nan
-        del break_pt
-
-    # 2. no soil chamber sensors before 12 April 2016 10:37:09 am
-    if doy < 102:
-        df_sc_sensor[['T_ch_4', 'T_ch_5', 'T_ch_6']] = np.nan
-    elif doy == 102:
-        break_pt = (datetime.datetime(2016, 4, 12, 10, 37, 9) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_sc_sensor.loc[doy_sc_sensor < break_pt,
-                         ['T_ch_4', 'T_ch_5', 'T_ch_6']] = np.nan
-        del break_pt
-
-    # 3. remove 'PAR_ch_2' data before before 8 April 2016 09:40:25 am
-    if doy == 97:
-        df_lc_sensor['PAR_ch_2'] = np.nan
-    elif doy == 98:
-        break_pt = (datetime.datetime(2016, 4, 8, 9, 40, 25) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[doy_lc_sensor < break_pt, 'PAR_ch_2'] = np.nan
-        del break_pt
-
-    # 4. 'PAR_ch_2' data from 08:40 to 09:41 on 7 June 2016 were corrupt
-    if doy == 158:
-        break_pt1 = (datetime.datetime(2016, 6, 7, 8, 40) -
-                     datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        break_pt2 = (datetime.datetime(2016, 6, 7, 9, 41) -
-                     datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[
-            (doy_lc_sensor > break_pt1) & (doy_lc_sensor < break_pt2) &
-            (df_lc_sensor['PAR_ch_1'].values < 400.), 'PAR_ch_1'] = np.nan
-        df_lc_sensor.loc[
-            (doy_lc_sensor > break_pt1) & (doy_lc_sensor < break_pt2) &
-            (df_lc_sensor['PAR_ch_2'].values < 400.), 'PAR_ch_2'] = np.nan
-        del break_pt1, break_pt2
-
-    # 5. power failure for leaf chamber sensor logger
-    # no data from 30 Aug 2016 13:44:36 to 5 Sep 2016 11:22:44
-    if doy == 242:
-        break_pt = (datetime.datetime(2016, 8, 30, 13, 44, 36) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[doy_lc_sensor > break_pt, 1:] = np.nan
-    if 242 < doy < 248:
-        df_lc_sensor.loc[:, 1:] = np.nan
-    if doy == 248:
-        break_pt = (datetime.datetime(2016, 9, 5, 11, 22, 44) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[doy_lc_sensor < break_pt, 1:] = np.nan
-
-    # 6. thermocouple at channel 11 (T_ch_2) was fallen during
-    # 29 Aug 2016 09:00 to 12 Sep 2016 11:00
-    if 241 <= doy < 255:
-        df_lc_sensor['T_ch_2'] = np.nan
-    elif doy == 255:
-        break_pt = (datetime.datetime(2016, 9, 12, 11, 0, 0) -
-                    datetime.datetime(2016, 1, 1)).total_seconds() / 86400.
-        df_lc_sensor.loc[doy_lc_sensor < break_pt, 'T_ch_2'] = np.nan
-
-    # 7. Bad PAR measurements from 10:30 to 11:00 on 5 Oct 2016 (?)
-    # no action, since no abnormal measurements were detected in this period
-
-    # 8. allow -5 as the lower limit of PAR (tolerance for random errors)
-    df_lc_sensor.loc[df_lc_sensor['PAR_ch_1'] < -5., 'PAR_ch_1'] = np.nan
-    df_lc_sensor.loc[df_lc_sensor['PAR_ch_2'] < -5., 'PAR_ch_2'] = np.nan
-
-    # 9. identify corrupt thermocouple measurements using IQR criteria
-    for col in ['T_amb', 'T_ch_1', 'T_ch_2', 'T_ch_3']:
-        if np.sum(np.isfinite(df_lc_sensor[col].values)) > 0:
-            TC_lolim, TC_uplim = IQR_bounds_func(df_lc_sensor[col].values)
-            df_lc_sensor.loc[(df_lc_sensor[col] < TC_lolim) |
-                             (df_lc_sensor[col] > TC_uplim), col] = np.nan
-
-    for col in ['T_ch_4', 'T_ch_5', 'T_ch_6']:
-        if np.sum(np.isfinite(df_sc_sensor[col].values)) > 0:
-            TC_lolim, TC_uplim = IQR_bounds_func(df_sc_sensor[col].values)
-            df_sc_sensor.loc[(df_sc_sensor[col] < TC_lolim) |
-                             (df_sc_sensor[col] > TC_uplim), col] = np.nan
+    # mask corrupt data, by the rules in `preproc_qc.sensor_qc_rules`
+    sensor_qc.apply(doy_lc_sensor, df_lc_sensor)
+    sensor_qc.apply(doy_sc_sensor, df_sc_sensor)
 
-    df_all_sensor = pd.DataFrame(
-        columns=['doy', 'PAR_ch_1', 'PAR_ch_2', 'T_amb', 'T_ch_1', 'T_ch_2',
-                 'T_ch_3', 'T_ch_4', 'T_ch_5', 'T_ch_6'], dtype=np.float64)
-    df_all_sensor['doy'] = doy + np.arange(0, 86400, 5) / 86400.
+    # identify corrupt thermocouple measurements using IQR criteria
+    # over the whole day; in streaming mode, see below
+    tc_filter_window = preproc_config.run_options['tc_filter_window_hours']
+    if tc_filter_window is None:
+        for col in ['T_amb', 'T_ch_1', 'T_ch_2', 'T_ch_3']:
+            if np.sum(np.isfinite(df_lc_sensor[col].values)) > 0:
+                TC_lolim, TC_uplim = IQR_bounds_func(df_lc_sensor[col].values)
+                df_lc_sensor.loc[(df_lc_sensor[col] < TC_lolim) |
+                                 (df_lc_sensor[col] > TC_uplim), col] = np.nan
 
-    for col in df_lc_sensor.columns.values[1:]:
-        df_all_sensor.loc[ind_lc_sensor, col] = df_lc_sensor[col]
-    for col in df_sc_sensor.columns.values[1:]:
-        df_all_sensor.loc[ind_sc_sensor, col] = df_sc_sensor[col]
+        for col in ['T_ch_4', 'T_ch_5', 'T_ch_6']:
+            if np.sum(np.isfinite(df_sc_sensor[col].values)) > 0:
+                TC_lolim, TC_uplim = IQR_bounds_func(df_sc_sensor[col].values)
+                df_sc_sensor.loc[(df_sc_sensor[col] < TC_lolim) |
+                                 (df_sc_sensor[col] > TC_uplim), col] = np.nan
+
+    # assemble the 5-second grid of the day in an array; samples outside the
+    # day are dropped, not appended to the grid
+    duplicates = preproc_config.run_options['sensor_grid_duplicates']
+    lc_grid, n_out_lc, n_dup_lc = preproc_grid.scatter_to_grid(
+        ind_lc_sensor, df_lc_sensor.iloc[:, 1:].values, 17280, duplicates)
+    sc_grid, n_out_sc, n_dup_sc = preproc_grid.scatter_to_grid(
+        ind_sc_sensor, df_sc_sensor.iloc[:, 1:].values, 17280, duplicates)
+    if n_out_lc + n_out_sc + n_dup_lc + n_dup_sc > 0:
+        grid_report = (
+            'Day 20%s: %d sample(s) outside the day dropped, ' %
+            (run_date_str, n_out_lc + n_out_sc) +
+            '%d duplicate sample(s) resolved by \'%s\'.' %
+            (n_dup_lc + n_dup_sc, duplicates))
+    else:
+        grid_report = ''
+
+    df_all_sensor = pd.DataFrame(
+        np.column_stack((doy + np.arange(0, 86400, 5) / 86400.,
+                         lc_grid, sc_grid)),
+        columns=['doy'] + list(df_lc_sensor.columns.values[1:]) +
+        list(df_sc_sensor.columns.values[1:]))
+
+    if tc_filter_window is not None:
+        # streaming IQR filter of the thermocouple data: each hour of the
+        # grid, in time order, is filtered by the bounds of the trailing
+        # window up to it. this only simulates near-real-time processing on
+        # the gridded data of a complete day: days are processed
+        # independently, so the window does not extend before midnight, and
+        # the first hours of a day are filtered on less data than the window
+        tc_cols = ['T_amb', 'T_ch_1', 'T_ch_2', 'T_ch_3',
+                   'T_ch_4', 'T_ch_5', 'T_ch_6']
+        tc_values = df_all_sensor[tc_cols].values
+        tc_filter = preproc_qc.StreamingIQRFilter(len(tc_cols),
+                                                  tc_filter_window / 24.)
+        for hour in range(24):
+            rows = slice(hour * 720, (hour + 1) * 720)
+            tc_filter.filter(df_all_sensor['doy'].values[rows],
+                             tc_values[rows])
+        df_all_sensor[tc_cols] = tc_values
 
     # for i in range(df_all_sensor.shape[0]):
     #     loc_lc_sensor = np.where(
@@ -352,51 +285,282 @@ for doy in range(doy_start, doy_end):
         'T_ch_5': 2, 'T_ch_6': 2})
 
     # dump data into csv files; do not output row index
-    output_fname = output_dir + '/hyy16_sensor_data_20%s.csv' % run_date_str
     df_all_sensor.to_csv(output_fname, sep=',', na_rep='NaN', index=False)
+    if sensor_cube is not None:
+        sensor_cube.write_day(doy, df_all_sensor.iloc[:, 1:].values)
 
-    # daily plots for diagnosing wrong measurements
+    # data of the daily plot for diagnosing wrong measurements, rendered in
+    # the background by the plot pool of the main process
     if preproc_config.run_options['plot_sensor_data']:
-        fig, axes = plt.subplots(3, 1, sharex=True, figsize=(8, 8))
-        time_in_hour = (df_all_sensor['doy'].values - doy) * 24.
-        for col in ['PAR_ch_1', 'PAR_ch_2']:
-            axes[0].plot(time_in_hour, df_all_sensor[col].values,
-                         label=col, lw=1.)
-        axes[0].legend(loc='upper left', frameon=False, fontsize=10, ncol=2)
+        plot_data = ((df_all_sensor['doy'].values - doy) * 24.,
+                     {col: df_all_sensor[col].values
+                      for col in df_all_sensor.columns.values[1:]})
+    else:
+        plot_data = None
+
+    summary = (
+        '\n%d lines converted from sensor data file(s) on the day 20%s.\n' %
+        (df_all_sensor.shape[0], run_date_str) +
+        str(df_all_sensor.describe().transpose()))
+
+    del df_lc_sensor, df_sc_sensor, df_all_sensor, lc_grid, sc_grid
+
+    return True, summary, grid_report, plot_data
+
+
+def read_and_process_sensor_day(doy, run_date_str, lc_sensor_files,
+                                sc_sensor_files):
+    """Read and process the sensor data of one day, in a worker process."""
+    return process_sensor_day(
+        doy, run_date_str, *read_sensor_files(lc_sensor_files,
+                                              sc_sensor_files))
+
+
+# layout of the daily plots; see `preproc_plot`
+sensor_plot_layout = {
+    'name': 'sensor_data',
+    'figsize': (8, 8),
+    'panels': [
+        {'columns': ['PAR_ch_1', 'PAR_ch_2'], 'ncol': 2,
+         'ylabel': 'PAR ($\\mu$mol m$^{-2}$ s$^{-1}$)'},
+        {'columns': ['T_amb', 'T_ch_1', 'T_ch_2', 'T_ch_3'], 'ncol': 4,
+         'ylabel': 'Temperature ($\\degree$C)'},
+        {'columns': ['T_ch_4', 'T_ch_5', 'T_ch_6'], 'ncol': 3,
+         'ylabel': 'Temperature ($\\degree$C)'},
+    ],
+    'xlabel': 'Hour (UTC+2)',
+    'xlim': [0, 24],
+    'xticks': range(0, 25, 3),
+}
 
-        for col in ['T_amb', 'T_ch_1', 'T_ch_2', 'T_ch_3']:
-            axes[1].plot(time_in_hour, df_all_sensor[col].values,
-                         label=col, lw=1.)
-        axes[1].legend(loc='upper left', frameon=False, fontsize=10, ncol=4)
+year_start = 2016  # starting year for converting day of year values
 
-        for col in ['T_ch_4', 'T_ch_5', 'T_ch_6']:
-            axes[2].plot(time_in_hour, df_all_sensor[col].values,
-                         label=col, lw=1.)
-        axes[2].legend(loc='upper left', frameon=False, fontsize=10, ncol=3)
-
-        axes[0].set_ylabel('PAR ($\mu$mol m$^{-2}$ s$^{-1}$)')
-        axes[1].set_ylabel('Temperature ($\degree$C)')
-        axes[2].set_ylabel('Temperature ($\degree$C)')
-        axes[2].set_xlim([0, 24])
-        axes[2].xaxis.set_ticks(range(0, 25, 3))
-        axes[2].set_xlabel('Hour (UTC+2)')
-
-        fig.tight_layout()
-        fig.savefig(output_dir +
-                    '/plots/hyy16_sensor_data_20%s.png' % run_date_str)
-        fig.clf()
-        del fig, axes
-
-    if not args.flag_silent_mode:
-        print(
-            '\n%d lines converted from sensor data file(s) on the day 20%s.' %
-            (df_all_sensor.shape[0], run_date_str))
-        print(df_all_sensor.describe().transpose())
-
-    del df_lc_sensor, df_sc_sensor, df_all_sensor
-
-
-# echo program ending
-dt_end = datetime.datetime.now()
-print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
-print('Done. Finished in %.2f seconds.' % (dt_end - dt_start).total_seconds())
+# quality control rules, compiled once for all days
+sensor_qc = preproc_qc.QCRuleTable(preproc_qc.sensor_qc_rules, year_start)
+
+# state of a run, set by `main`; forked worker processes inherit it
+output_dir = None
+sensor_cube = None
+
+
+def main(argv=None):
+    """
+    Run the sensor data preprocessing.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. Default is None, for `sys.argv[1:]`.
+
+    Return
+    ------
+    status : int
+        Exit status: 0 on success.
+
+    """
+    global output_dir, sensor_cube
+
+    # define terminal argument parser
+    parser = argparse.ArgumentParser(
+        description='Extract, combine, and correct chamber sensor data.')
+    parser.add_argument('-s', '--silent', dest='flag_silent_mode',
+                        action='store_true',
+                        help='silent mode: run without printing daily summary')
+    parser.add_argument('-j', '--jobs', dest='n_jobs', type=int, default=1,
+                        help='number of worker processes for the daily loop')
+    args = parser.parse_args(argv)
+
+    # echo program starting
+    print('Subsetting, gapfilling and downsampling the biomet sensor data...')
+    dt_start = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
+    print('numpy version = ' + np.__version__)
+    print('pandas version = ' + pd.__version__)
+    if preproc_config.run_options['plot_sensor_data']:
+        print('Plotting option is enabled. Will generate daily plots.')
+
+    # settings
+    pd.options.display.float_format = '{:.2f}'.format
+    # let pandas dataframe displays float with 2 decimal places
+
+    if preproc_config.run_options['plot_sensor_data']:
+        # matplotlib is imported only to plot; forked plot workers inherit the
+        # style settings
+        import matplotlib.pyplot as plt
+        plt.rcParams.update({'mathtext.default': 'regular'})  # sans-serif math
+        plt.style.use('ggplot')
+
+    sensor_dir = preproc_config.data_dir['sensor_data_raw']
+    output_dir = preproc_config.data_dir['sensor_data_reformatted']
+
+    # index the sensor data files by date, for lookup by day
+    lc_sensor_index = preproc_io.file_index(
+        sensor_dir + '/sm_cop/*.cop',
+        preproc_config.data_dir['sensor_file_index'])  # leaf chamber sensors
+    sc_sensor_index = preproc_io.file_index(
+        sensor_dir + '/sm_mpr/*.mpr',
+        preproc_config.data_dir['sensor_file_index'])  # soil chamber sensors
+
+    # local time is UTC+2
+    doy_today = (datetime.datetime.utcnow() -
+                 datetime.datetime(2016, 1, 1)).total_seconds() / 86400. + \
+        2. / 24.
+
+    if preproc_config.run_options['process_recent_period']:
+        doy_start = np.int(doy_today -
+                           preproc_config.run_options['traceback_in_days'])
+        doy_end = np.int(np.ceil(doy_today))
+    else:
+        doy_start = 97  # campaign starts on 7 Apr 2016
+        doy_end = 315  # campaign ends on 10 Nov 2016 (plus one for `range()`)
+
+    # limit the range to the days that have data files
+    doy_with_data = sorted(
+        (datetime.datetime.strptime(date_str, '%y%m%d') -
+         datetime.datetime(2016, 1, 1)).days
+        for date_str in set(lc_sensor_index) | set(sc_sensor_index))
+    if len(doy_with_data) > 0:
+        doy_start = max(doy_start, doy_with_data[0])
+        doy_end = min(doy_end, doy_with_data[-1] + 1)
+
+    # with the run manifest, skip the days whose input files, config and code
+    # are unchanged since their output was written
+    if preproc_config.run_options['use_run_manifest']:
+        manifest = preproc_manifest.RunManifest(
+            output_dir + '/hyy16_sensor_data_manifest.json',
+            preproc_manifest.config_digest({
+                'sensor_data_reformatted': output_dir,
+                'plot_sensor_data':
+                preproc_config.run_options['plot_sensor_data'],
+                'sensor_grid_duplicates':
+                preproc_config.run_options['sensor_grid_duplicates'],
+                'write_data_cube':
+                preproc_config.run_options['write_data_cube'],
+                'tc_filter_window_hours':
+                preproc_config.run_options['tc_filter_window_hours']}),
+            preproc_manifest.code_digest(__file__, preproc_grid.__file__,
+                                         preproc_qc.__file__))
+    else:
+        manifest = None
+    n_days_skipped = 0
+
+    # optional output of all days in a single memory-mapped array file; it is
+    # grown to the range of days before any worker process is forked
+    if preproc_config.run_options['write_data_cube']:
+        sensor_cube = preproc_grid.GridCube(
+            output_dir + '/hyy16_sensor_data_cube',
+            ['PAR_ch_1', 'PAR_ch_2', 'T_amb', 'T_ch_1', 'T_ch_2', 'T_ch_3',
+             'T_ch_4', 'T_ch_5', 'T_ch_6'], 5.)
+        sensor_cube.ensure_days(doy_start, doy_end)
+        # days new to the cube must be processed again, even if their CSV
+        # outputs are up to date
+        if manifest is not None:
+            for doy in sensor_cube.added_days:
+                manifest.discard((datetime.datetime(2016, 1, 1) +
+                                  datetime.timedelta(doy + 0.5)).strftime(
+                                      '%y%m%d'))
+    else:
+        sensor_cube = None
+
+    # data fields in the leaf chamber sensor data file (*.cop)
+    # correspondence between chamber number and sensor number was changing
+    # throughout the campaign. refer to the metadata table for the information.
+    # 0 - time; 1 - PAR_ch_1; 2 - PAR_ch_2;
+    # 8 - ambient T; 10 - T_ch_1;
+    # 11 - T_ch_2; 12 - T_ch_3;
+
+    # data fields in the soil chamber sensor data file (*.mpr)
+    # 0 - time; 5 - soil chamber 1 (T_ch_4); 6 - soil chamber 2 (T_ch_5)
+    # 7 - soil chamber 3 (T_ch_6)
+    day_flists = []
+    for doy in range(doy_start, doy_end):
+        run_date_str = (datetime.datetime(2016, 1, 1) +
+                        datetime.timedelta(doy + 0.5)).strftime('%y%m%d')
+        current_lc_sensor_files = lc_sensor_index.get(run_date_str, [])
+        current_sc_sensor_files = sc_sensor_index.get(run_date_str, [])
+        output_fname = output_dir + '/hyy16_sensor_data_20%s.csv' % \
+            run_date_str
+
+        if manifest is not None and manifest.is_up_to_date(
+                run_date_str,
+                current_lc_sensor_files + current_sc_sensor_files,
+                [output_fname]):
+            n_days_skipped += 1
+            continue
+
+        day_flists.append((doy, run_date_str, current_lc_sensor_files,
+                           current_sc_sensor_files))
+
+    # daily plots are rendered in the background by a separate pool of worker
+    # processes, which reuse their figures, so that processing never waits for
+    # rendering
+    if preproc_config.run_options['plot_sensor_data']:
+        import preproc_plot
+        plot_pool = preproc_plot.PlotPool(
+            preproc_config.run_options['plot_workers'])
+    else:
+        plot_pool = None
+
+    # each day is independent of the others, so the days can be farmed out to
+    # a pool of worker processes, which read their own files; otherwise, the
+    # files of the upcoming days are read concurrently in a thread pool, while
+    # the current day is being processed
+    if args.n_jobs > 1:
+        pool = multiprocessing.get_context('fork').Pool(args.n_jobs)
+        day_summaries = preproc_parallel.imap_bounded(
+            pool, read_and_process_sensor_day, day_flists, 2 * args.n_jobs)
+    else:
+        pool = None
+        day_sensor_data = preproc_parallel.imap_threads(
+            lambda day_flist: read_sensor_files(day_flist[2], day_flist[3]),
+            day_flists, preproc_config.run_options['io_workers'])
+        day_summaries = (
+            process_sensor_day(day_flist[0], day_flist[1], *sensor_data)
+            for day_flist, sensor_data in zip(day_flists, day_sensor_data))
+
+    # daily summaries are printed by the main process in the order of days
+    for (doy, run_date_str, current_lc_sensor_files,
+         current_sc_sensor_files), \
+            (is_processed, summary, grid_report, plot_data) in \
+            zip(day_flists, day_summaries):
+        if not is_processed:
+            print(summary)
+            continue
+
+        if grid_report:
+            print(grid_report)
+
+        if not args.flag_silent_mode:
+            print(summary)
+
+        if plot_data is not None:
+            plot_pool.submit(
+                sensor_plot_layout, plot_data[0], plot_data[1],
+                output_dir + '/plots/hyy16_sensor_data_20%s.png' %
+                run_date_str)
+
+        if manifest is not None:
+            manifest.update(run_date_str,
+                            current_lc_sensor_files + current_sc_sensor_files)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if plot_pool is not None:
+        plot_pool.close()
+
+    if manifest is not None:
+        manifest.save()
+        print('%d day(s) skipped with unchanged inputs.' % n_days_skipped)
+
+    # echo program ending
+    dt_end = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
+    print('Done. Finished in %.2f seconds.' %
+          (dt_end - dt_start).total_seconds())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
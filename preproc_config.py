@@ -8,12 +8,29 @@ data_dir = {
     'flow_data_reformatted':
     '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/preprocessed/flow/',
 
+    'flow_data_cache':
+    '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/cache/flow/',
+    # binary cache of parsed raw flow data files; set to None to disable
+
     'sensor_data_raw':
     '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/sensor_data/',
 
     'sensor_data_reformatted':
     '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/preprocessed/sensor/',
 
+    'sensor_file_index':
+    '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/cache/sensor_files.json',
+    # date-keyed index of raw sensor data files; set to None to disable
+
+    'smear_chunks':
+    '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/cache/smear/',
+    # fetched time windows of SMEAR data, to resume interrupted downloads;
+    # set to None to disable
+
+    'smear_responses':
+    '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/cache/smear_responses/',
+    # cached responses of SMEAR API queries; set to None to disable
+
     'met_data':
     '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/preprocessed/met/',
 
@@ -26,6 +43,10 @@ data_dir = {
     'chflux_data':
     '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/processed/chflux/',
     # processed chamber flux data
+
+    'pipeline':
+    '/Users/wusun/Dropbox/Projects/hyytiala_2016/data/cache/pipeline/',
+    # logs of the pipeline stages, and the state of their last runs
 }
 
 run_options = {
@@ -33,7 +54,47 @@ run_options = {
 
     'traceback_in_days': 3,
 
+    'use_run_manifest': False,
+    # skip the days whose input files, config and code are unchanged
+
+    'io_workers': 4,
+    # number of threads to read and parse raw data files concurrently
+
+    'write_data_cube': False,
+    # also write all days into a memory-mapped `days x samples x channels`
+    # array file per product, see `preproc_grid.GridCube`
+
+    'smear_connections': 8,
+    # maximum number of concurrent requests to the SMEAR data API
+
+    'smear_window_days': 7,
+    # length of the time windows of SMEAR data requests; None for one window
+
+    'smear_batch_values': 50000,
+    # target number of values (rows x variables) per SMEAR data request;
+    # variables are batched into requests up to this size
+
+    'smear_overlap_days': 1,
+    # in the append mode of SMEAR data fetching, re-fetch this many days
+    # before the last timestamp of the existing table, to update late data
+
+    'smear_cache_ttl_hours': 1,
+    # lifetime of the cached responses of SMEAR queries that reach less than
+    # a day before now; responses of earlier queries never expire
+
     'plot_flow_data': False,
 
     'plot_sensor_data': False,
+
+    'plot_workers': 2,
+    # number of processes to render daily plots in the background; 0 to
+    # render them in the main process
+
+    'sensor_grid_duplicates': 'last',
+    # samples of the same 5-second grid point: keep the 'last' or the 'mean'
+
+    'tc_filter_window_hours': None,
+    # IQR filter of thermocouple data: None for the bounds of the whole day;
+    # a number of hours for a simulated streaming filter over a trailing
+    # window, within each day
 }
@@ -0,0 +1,252 @@
+"""
+Helpers to assemble time series on regular time grids.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+"""
+import os
+import json
+import numpy as np
+
+
+def grid_indices(doy, doy_grid_start, time_step):
+    """
+    Get the grid indices of samples, rounded to the nearest grid point.
+
+    Parameters
+    ----------
+    doy : array_like
+        Day of year values of the samples. NaN is allowed.
+    doy_grid_start : float
+        Day of year value of the first grid point.
+    time_step : float
+        Time step of the grid, in seconds.
+
+    Return
+    ------
+    ind : array_like
+        Grid indices of the samples; -1 for samples with NaN time.
+
+    """
+    ind = (np.asarray(doy, dtype=np.float64) - doy_grid_start) * 86400. / \
+        time_step
+    ind[~np.isfinite(ind)] = -1.
+    return np.round(ind).astype(np.int64)
+
+
+def scatter_to_grid(ind, values, n_samples, duplicates='last'):
+    """
+    Scatter samples onto a preallocated grid, with bounds checking.
+
+    Parameters
+    ----------
+    ind : array_like
+        Grid indices of the samples, e.g., from `grid_indices()`.
+    values : array_like
+        Sample values, a 2D array with one row per sample.
+    n_samples : int
+        Number of grid points.
+    duplicates : str, optional
+        Policy for samples falling on the same grid point:
+        - 'last' (default): the last sample in order is kept;
+        - 'mean': the finite values of the samples are averaged.
+
+    Return
+    ------
+    grid : array_like
+        Gridded values, (n_samples, n_columns); NaN where no sample falls.
+    n_out_of_range : int
+        Number of samples outside the grid (including NaN time), dropped.
+    n_duplicates : int
+        Number of samples falling on an already occupied grid point.
+
+    """
+    ind = np.asarray(ind, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64).reshape(ind.size, -1)
+    in_range = (ind >= 0) & (ind < n_samples)
+    n_out_of_range = int(ind.size - np.sum(in_range))
+    ind = ind[in_range]
+    values = values[in_range]
+
+    grid = np.full((n_samples, values.shape[1]), np.nan)
+    if duplicates == 'last':
+        # position of the last occurrence of each index
+        ind_unique, loc_reversed = np.unique(ind[::-1], return_index=True)
+        grid[ind_unique] = values[ind.size - 1 - loc_reversed]
+    elif duplicates == 'mean':
+        ind_unique = np.unique(ind)
+        is_finite = np.isfinite(values)
+        sums = np.zeros_like(grid)
+        counts = np.zeros(grid.shape, dtype=np.int64)
+        np.add.at(sums, ind, np.where(is_finite, values, 0.))
+        np.add.at(counts, ind, is_finite)
+        with np.errstate(invalid='ignore'):
+            grid[ind_unique] = sums[ind_unique] / counts[ind_unique]
+    else:
+        raise ValueError('Unknown policy for duplicate samples: %s' %
+                         duplicates)
+    n_duplicates = int(ind.size - ind_unique.size)
+
+    return grid, n_out_of_range, n_duplicates
+
+
+class GridCube(object):
+    """
+    Gridded data of a campaign in a memory-mapped `days x samples x channels`
+    array file.
+
+    The array is stored in `<filepath>.dat` as raw float64 values in C order,
+    with a small JSON header in `<filepath>.json`: channel names, the first
+    day of year, the number of days, the time step and the time offset of the
+    samples in each day. Days not written yet are NaN. Use `load_cube()` to
+    read the array. The days added to the cube by this instance, all NaN, are
+    kept in `added_days`, e.g., to process them again even if their other
+    outputs are up to date.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the cube files, without extension.
+    channels : list of str
+        Channel names.
+    time_step : float
+        Time step of the samples, in seconds, a divisor of 86400.
+    sample_offset : float, optional
+        Time of the first sample after the start of each day, in seconds.
+        Default is 0.
+
+    """
+
+    def __init__(self, filepath, channels, time_step, sample_offset=0.):
+        self.filepath = filepath
+        self.header = {
+            'channels': list(channels),
+            'time_step': float(time_step),
+            'sample_offset': float(sample_offset),
+            'samples_per_day': int(round(86400. / time_step)),
+            'dtype': '<f8',
+            'doy_start': None,
+            'n_days': 0,
+        }
+        self.added_days = set()
+        try:
+            with open(filepath + '.json', 'r') as f:
+                header = json.load(f)
+        except (IOError, OSError):
+            return  # a new cube
+        if not os.path.isfile(filepath + '.dat'):
+            return  # the array file is lost; a new cube
+        layout_keys = ['channels', 'time_step', 'sample_offset',
+                       'samples_per_day', 'dtype']
+        if any(header[k] != self.header[k] for k in layout_keys):
+            raise ValueError('Layout of the data cube %s does not match; '
+                             'remove its files to rebuild it.' % filepath)
+        self.header = header
+
+    @property
+    def _day_shape(self):
+        return (self.header['samples_per_day'], len(self.header['channels']))
+
+    def _save_header(self):
+        with open(self.filepath + '.json.tmp', 'w') as f:
+            json.dump(self.header, f, indent=1, sort_keys=True)
+        os.replace(self.filepath + '.json.tmp', self.filepath + '.json')
+
+    def ensure_days(self, doy_start, doy_end):
+        """
+        Grow the cube to cover a range of days, `doy_end` excluded.
+
+        Call this before forking worker processes that write to the cube.
+        Days after the current range are appended in place; days before it
+        require rewriting the array file.
+        """
+        doy_start, doy_end = int(doy_start), int(doy_end)
+        if doy_end <= doy_start:
+            return
+        day_size = np.prod(self._day_shape)
+        if self.header['doy_start'] is None:
+            self.header['doy_start'] = doy_start
+            self.header['n_days'] = 0
+            open(self.filepath + '.dat', 'wb').close()
+        cube_start = self.header['doy_start']
+        cube_end = cube_start + self.header['n_days']
+        # days outside the current range are filled with NaN
+        self.added_days.update(range(doy_start, cube_start))
+        self.added_days.update(range(cube_end, doy_end))
+
+        if doy_start < cube_start:
+            # shift the existing days into a new file
+            n_days = cube_end - doy_start
+            new_data = np.memmap(self.filepath + '.dat.tmp', dtype='<f8',
+                                 mode='w+',
+                                 shape=(n_days,) + self._day_shape)
+            new_data[:cube_start - doy_start] = np.nan
+            if self.header['n_days'] > 0:
+                new_data[cube_start - doy_start:] = np.memmap(
+                    self.filepath + '.dat', dtype='<f8', mode='r',
+                    shape=(self.header['n_days'],) + self._day_shape)
+            new_data.flush()
+            del new_data
+            os.replace(self.filepath + '.dat.tmp', self.filepath + '.dat')
+            self.header['doy_start'] = cube_start = doy_start
+            self.header['n_days'] = n_days
+
+        if doy_end > cube_end:
+            # append days filled with NaN, one day at a time
+            with open(self.filepath + '.dat', 'ab') as f:
+                nan_day = np.full(day_size, np.nan, dtype='<f8').tobytes()
+                for _ in range(cube_end, doy_end):
+                    f.write(nan_day)
+            self.header['n_days'] = doy_end - cube_start
+
+        self._save_header()
+
+    def write_day(self, doy, values):
+        """
+        Write the gridded data of a day in place.
+
+        The day must be in the range of the cube (see `ensure_days()`).
+        Different days can be written concurrently by different processes.
+        """
+        loc = int(doy) - self.header['doy_start']
+        if not 0 <= loc < self.header['n_days']:
+            raise ValueError('Day %d is out of the range of the data cube %s'
+                             % (doy, self.filepath))
+        values = np.asarray(values, dtype='<f8')
+        if values.shape != self._day_shape:
+            raise ValueError('Shape of the day %s does not match the data '
+                             'cube %s' % (values.shape, self.filepath))
+        day_data = np.memmap(self.filepath + '.dat', dtype='<f8', mode='r+',
+                             offset=loc * values.nbytes,
+                             shape=self._day_shape)
+        day_data[:] = values
+        day_data.flush()
+        del day_data
+
+
+def load_cube(filepath):
+    """
+    Load a data cube written by `GridCube`, without parsing.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the cube files, without extension.
+
+    Return
+    ------
+    data : array_like
+        Read-only memory map of shape (days, samples, channels). The samples
+        of day `header['doy_start'] + i` are `data[i]`, at the times
+        `sample_offset + j * time_step` seconds after the start of the day.
+    header : dict
+        Header of the cube.
+
+    """
+    with open(filepath + '.json', 'r') as f:
+        header = json.load(f)
+    data = np.memmap(filepath + '.dat', dtype=header['dtype'], mode='r',
+                     shape=(header['n_days'], header['samples_per_day'],
+                            len(header['channels'])))
+    return data, header
@@ -0,0 +1,252 @@
+"""
+Input helpers shared by the preprocessing scripts.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+"""
+import os
+import re
+import glob
+import json
+import datetime
+import numpy as np
+import preproc_parallel
+
+
+def file_signature(filepath):
+    """Get the size and the modification time of a file to detect changes."""
+    file_stat = os.stat(filepath)
+    return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+
+
+def combine_timestamp_columns(year, month, day, hour, minute, second):
+    """
+    Combine date and time component arrays into timestamps, vectorized.
+
+    Parameters
+    ----------
+    year, month, day, hour, minute, second : array_like
+        Integer date and time components, of the same size.
+
+    Return
+    ------
+    timestamps : array_like
+        Timestamps in `numpy.datetime64[s]`. Invalid dates or times (e.g.,
+        month 13, or 30 Feb) are NaT.
+
+    """
+    year, month, day, hour, minute, second = [
+        np.asarray(x, dtype=np.int64) for x in
+        (year, month, day, hour, minute, second)]
+    is_valid = (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & \
+        (hour >= 0) & (hour <= 23) & (minute >= 0) & (minute <= 59) & \
+        (second >= 0) & (second <= 59)
+    year_month = (year - 1970).astype('datetime64[Y]').astype(
+        'datetime64[M]') + np.where(is_valid, month - 1, 0)
+    date = year_month.astype('datetime64[D]') + np.where(is_valid, day - 1, 0)
+    # a day beyond the end of the month rolls over to the next month
+    is_valid &= date.astype('datetime64[M]') == year_month
+    timestamps = date.astype('datetime64[s]') + \
+        (hour * 3600 + minute * 60 + second)
+    timestamps[~is_valid] = np.datetime64('NaT')
+    return timestamps
+
+
+def parse_timestamp_digits(timestamp_strings):
+    """
+    Parse fixed-format 'YYYYMMDDhhmmss' timestamp strings, vectorized.
+
+    The digits are decoded with integer arithmetic on the character codes,
+    instead of parsing each string in Python.
+
+    Parameters
+    ----------
+    timestamp_strings : array_like
+        Timestamp strings, e.g., '20160407093341'. Other values, such as NaN
+        for missing fields, are allowed.
+
+    Return
+    ------
+    timestamps : array_like
+        Timestamps in `numpy.datetime64[s]`. Strings that are not 14 digits
+        long, or not valid dates and times, are NaT.
+
+    """
+    # fixed-width unicode strings of one more character than the format, as
+    # a (n, 15) array of character codes; shorter strings are padded with
+    # zero codes, and longer strings have a nonzero code at the last place
+    codes = np.asarray(timestamp_strings).astype('<U15').view(
+        np.uint32).reshape(-1, 15)
+    digits = codes[:, 0:14].astype(np.int64) - ord('0')
+    is_valid = (codes[:, 14] == 0) & \
+        np.all((digits >= 0) & (digits <= 9), axis=1)
+    digits[~is_valid, :] = 0
+
+    def digits_to_int(start, stop):
+        return digits[:, start:stop].dot(10 ** np.arange(stop - start - 1,
+                                                         -1, -1))
+
+    timestamps = combine_timestamp_columns(
+        digits_to_int(0, 4), digits_to_int(4, 6), digits_to_int(6, 8),
+        digits_to_int(8, 10), digits_to_int(10, 12), digits_to_int(12, 14))
+    timestamps[~is_valid] = np.datetime64('NaT')
+    return timestamps
+
+
+def index_files_by_date(filepaths):
+    """
+    Index data files by the date in their file names.
+
+    The date is the first group of digits in the file name that is a valid
+    'yymmdd' date, or the 'yymmdd' part of a valid 'yyyymmdd' date. Other
+    groups of digits, e.g., a counter in a backup file name, are skipped, and
+    files without a date are ignored.
+
+    Parameters
+    ----------
+    filepaths : list of str
+        Paths of the data files.
+
+    Return
+    ------
+    file_index : dict
+        Sorted lists of file paths, keyed by date strings 'yymmdd'.
+
+    """
+    file_index = {}
+    for filepath in sorted(filepaths):
+        for match in re.finditer(r'(?<!\d)(?:20)?(\d{6})(?!\d)',
+                                 os.path.basename(filepath)):
+            try:
+                datetime.datetime.strptime(match.group(1), '%y%m%d')
+            except ValueError:
+                continue
+            file_index.setdefault(match.group(1), []).append(filepath)
+            break
+    return file_index
+
+
+def file_index(glob_pattern, index_path=None):
+    """
+    Build the date-keyed index of data files matching a pattern.
+
+    If `index_path` is given, the file list is saved in that JSON file and
+    reused in later runs without listing the directory again, as long as the
+    modification time of the directory is unchanged, i.e., no file has been
+    added, removed or renamed.
+
+    Parameters
+    ----------
+    glob_pattern : str
+        Pattern of the data files, e.g., '/path/to/sm_cop/*.cop'.
+    index_path : str, optional
+        Path of the JSON file that persists file lists between runs.
+
+    Return
+    ------
+    file_index : dict
+        Sorted lists of file paths, keyed by date strings 'yymmdd'.
+
+    """
+    dir_mtime_ns = os.stat(os.path.dirname(glob_pattern)).st_mtime_ns
+    persisted = {}
+    if index_path is not None:
+        try:
+            with open(index_path, 'r') as f:
+                persisted = json.load(f)
+        except (IOError, OSError, ValueError):
+            persisted = {}  # a missing or corrupt index is simply rebuilt
+        entry = persisted.get(glob_pattern)
+        if entry is not None and entry['dir_mtime_ns'] == dir_mtime_ns:
+            return index_files_by_date(entry['files'])
+
+    filepaths = glob.glob(glob_pattern)
+    if index_path is not None:
+        persisted[glob_pattern] = {'dir_mtime_ns': dir_mtime_ns,
+                                   'files': sorted(filepaths)}
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)),
+                    exist_ok=True)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(persisted, f)
+        os.replace(index_path + '.tmp', index_path)
+    return index_files_by_date(filepaths)
+
+
+def read_files(filepaths, reader, max_workers=1):
+    """
+    Read and parse files concurrently in a thread pool.
+
+    Parameters
+    ----------
+    filepaths : list of str
+        Paths of the files to read.
+    reader : callable
+        Function that reads and parses a file.
+    max_workers : int, optional
+        Number of worker threads. Default is 1, to read in this thread.
+
+    Return
+    ------
+    parsed : list
+        Parsed contents of the files, in the order of `filepaths`.
+
+    """
+    return list(preproc_parallel.imap_threads(
+        reader, filepaths, max_workers, max_pending=max(len(filepaths), 1)))
+
+
+def load_cached_array(filepath, parser, cache_dir, columns):
+    """
+    Load a data file as a 2D array through a persistent binary cache.
+
+    The parsed array of each file is saved as a `.npy` file in the cache
+    directory, along with a `.json` sidecar recording the size and the
+    modification time of the source file and the column names. If they still
+    match, the cached array is memory-mapped instead of parsing the file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the data file.
+    parser : callable
+        Function that parses the data file into a 2D array.
+    cache_dir : str or None
+        Directory of the cache. If None, the file is always parsed.
+    columns : list of str
+        Column names of the parsed array, to invalidate the cache entries of
+        an outdated column layout.
+
+    Return
+    ------
+    data : array_like
+        Parsed data, or a read-only memory map of the cached array.
+    is_cached : bool
+        True if the data are loaded from the cache.
+
+    """
+    if cache_dir is None:
+        return parser(filepath), False
+
+    cache_fname = os.path.join(cache_dir, os.path.basename(filepath))
+    signature = file_signature(filepath)
+    signature['columns'] = list(columns)
+    try:
+        with open(cache_fname + '.json', 'r') as f:
+            cached_signature = json.load(f)
+        if cached_signature == signature:
+            return np.load(cache_fname + '.npy', mmap_mode='r'), True
+    except (IOError, OSError, ValueError):
+        pass  # a missing or corrupt cache entry is simply rebuilt
+
+    data = np.ascontiguousarray(parser(filepath))
+    os.makedirs(cache_dir, exist_ok=True)
+    # write the array before its sidecar, each by atomic renaming, so that an
+    # interrupted run never leaves a valid sidecar next to a stale array
+    with open(cache_fname + '.npy.tmp', 'wb') as f:
+        np.save(f, data)
+    os.replace(cache_fname + '.npy.tmp', cache_fname + '.npy')
+    with open(cache_fname + '.json.tmp', 'w') as f:
+        json.dump(signature, f)
+    os.replace(cache_fname + '.json.tmp', cache_fname + '.json')
+    return data, False
@@ -0,0 +1,183 @@
+"""
+Leaf area of the leaf chambers, as a vectorized lookup by time.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+The leaf area of a pine chamber (LC-S-A, LC-S-B, LC-L-A) is constant during
+each installation, as recorded in `chamber_metadata.csv`, and is that of the
+latest installation in between. The leaf area of an aspen chamber (LC-XL,
+LC-Slide) is interpolated linearly between the measurements in
+`aspen_leaf_area_<ch_label>.csv`; it is NaN before the first measurement, and
+constant after the last.
+
+"""
+import os
+import numpy as np
+import pandas as pd
+
+
+pine_chambers = ['LC-S-A', 'LC-S-B', 'LC-L-A']
+
+aspen_chambers = ['LC-XL', 'LC-Slide']
+
+
+def read_chamber_metadata(filepath):
+    """Read the chamber installations from `chamber_metadata.csv`."""
+    df_pine = pd.read_csv(
+        filepath, engine='c', comment='#', parse_dates=[14, 15],
+        usecols=None, infer_datetime_format=True)
+    return df_pine[['species', 'leaf_area', 'ch_label',
+                    'install_datetime', 'uninstall_datetime', 'ch_no']]
+
+
+def read_aspen_leaf_area(filepath):
+    """Read the leaf area measurements of an aspen chamber."""
+    return pd.read_csv(
+        filepath, engine='c', comment='#', parse_dates=[0],
+        usecols=[0, 1], infer_datetime_format=True)
+
+
+def _to_doy(times, year=2016):
+    """Convert datetime64 values to day of year values."""
+    return (times - np.datetime64('%d-01-01' % year)) / \
+        np.timedelta64(1, 'D')
+
+
+class LeafAreaLookup(object):
+    """
+    Leaf area of the leaf chambers at any times.
+
+    The installation and measurement times are kept sorted, so that a lookup
+    takes one `numpy.searchsorted` (pine) or `numpy.interp` (aspen) per
+    chamber, for any number of times.
+
+    Parameters
+    ----------
+    df_pine : pandas.DataFrame
+        Chamber installations, with the columns 'ch_label', 'leaf_area',
+        'install_datetime' and 'uninstall_datetime'; see
+        `read_chamber_metadata`. Installations without leaf area are skipped.
+    aspen_tables : dict
+        Leaf area measurements of the aspen chambers, keyed by chamber label,
+        as tables of the columns 'datetime' and 'leaf_area'; see
+        `read_aspen_leaf_area`.
+
+    """
+
+    def __init__(self, df_pine, aspen_tables):
+        # install times, uninstall times and leaf areas of the pine chambers
+        self.installs = {}
+        for ch_label in pine_chambers:
+            df_ch = df_pine.loc[(df_pine['ch_label'] == ch_label) &
+                                np.isfinite(df_pine['leaf_area']), :]
+            df_ch = df_ch.sort_values(by='install_datetime', kind='mergesort')
+            self.installs[ch_label] = (
+                df_ch['install_datetime'].values.astype('datetime64[ns]'),
+                df_ch['uninstall_datetime'].values.astype('datetime64[ns]'),
+                df_ch['leaf_area'].values.astype(np.float64))
+        # measurement times and leaf areas of the aspen chambers
+        self.measurements = {}
+        for ch_label in aspen_chambers:
+            df_ch = aspen_tables[ch_label]
+            df_ch = df_ch.loc[np.isfinite(df_ch['leaf_area']), :]
+            df_ch = df_ch.sort_values(by='datetime', kind='mergesort')
+            self.measurements[ch_label] = (
+                df_ch['datetime'].values.astype('datetime64[ns]'),
+                df_ch['leaf_area'].values.astype(np.float64))
+
+    @property
+    def ch_labels(self):
+        """Labels of the leaf chambers."""
+        return pine_chambers + aspen_chambers
+
+    def leaf_area(self, ch_label, times):
+        """
+        Get the leaf area of a chamber at given times.
+
+        Parameters
+        ----------
+        ch_label : str
+            Label of the leaf chamber.
+        times : array_like
+            Times, as datetime64 values or anything convertible to them,
+            e.g., a `pandas.DatetimeIndex`.
+
+        Return
+        ------
+        leaf_area : numpy.ndarray
+            Leaf area at the times, in the shape of `times`. NaN at missing
+            times.
+
+        """
+        times = np.asarray(times, dtype='datetime64[ns]')
+        if ch_label in self.installs:
+            install_times, _, values = self.installs[ch_label]
+            if values.size == 0:
+                return np.full(times.shape, np.nan)
+            # the latest installation, or the first one before all of them
+            ind = np.searchsorted(install_times, times, side='right') - 1
+            return np.where(np.isnat(times), np.nan,
+                            values[np.clip(ind, 0, None)])
+        if ch_label in self.measurements:
+            measure_times, values = self.measurements[ch_label]
+            if values.size == 0:
+                return np.full(times.shape, np.nan)
+            return np.interp(_to_doy(times), _to_doy(measure_times), values,
+                             left=np.nan, right=None)
+        raise KeyError('Not a leaf chamber: %s' % ch_label)
+
+    def breakpoints(self):
+        """
+        Get the times where the leaf area of any chamber may change: the
+        installations, the last second of each installation, and the
+        measurements.
+        """
+        times = [self.measurements[ch_label][0]
+                 for ch_label in aspen_chambers]
+        for ch_label in pine_chambers:
+            install_times, uninstall_times, _ = self.installs[ch_label]
+            times.extend([install_times,
+                          uninstall_times - np.timedelta64(1, 's')])
+        return np.unique(np.concatenate(times))
+
+    def table(self, times=None):
+        """
+        Tabulate the leaf area of all chambers.
+
+        Parameters
+        ----------
+        times : array_like, optional
+            Times of the table rows. Default is the breakpoints of the leaf
+            area; see `breakpoints`.
+
+        Return
+        ------
+        df_la : pandas.DataFrame
+            Table of the columns 'datetime', 'doy', and the leaf area of the
+            chambers.
+
+        """
+        if times is None:
+            times = self.breakpoints()
+        times = np.asarray(times, dtype='datetime64[ns]')
+        df_la = pd.DataFrame({'datetime': times, 'doy': _to_doy(times)},
+                             columns=['datetime', 'doy'])
+        for ch_label in self.ch_labels:
+            df_la[ch_label] = self.leaf_area(ch_label, times)
+        return df_la
+
+
+def load_lookup(raw_dir):
+    """
+    Build the leaf area lookup from the raw data files in a directory:
+    `chamber_metadata.csv`, `aspen_leaf_area_LC-XL.csv` and
+    `aspen_leaf_area_LC-Slide.csv`.
+    """
+    df_pine = read_chamber_metadata(
+        os.path.join(raw_dir, 'chamber_metadata.csv'))
+    aspen_tables = {
+        ch_label: read_aspen_leaf_area(
+            os.path.join(raw_dir, 'aspen_leaf_area_%s.csv' % ch_label))
+        for ch_label in aspen_chambers}
+    return LeafAreaLookup(df_pine, aspen_tables)
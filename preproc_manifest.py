@@ -0,0 +1,155 @@
+"""
+Run manifest of the daily outputs, for incremental preprocessing.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+"""
+import os
+import json
+import hashlib
+import preproc_io
+
+
+def file_digest(filepath, chunk_size=1 << 20):
+    """Get the SHA-1 hash of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def config_digest(config):
+    """Get the SHA-1 hash of a JSON-serializable configuration."""
+    return hashlib.sha1(
+        json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def code_digest(*filepaths):
+    """Get the SHA-1 hash of source files, as the version of the code."""
+    sha1 = hashlib.sha1()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+class RunManifest(object):
+    """
+    Manifest of the daily outputs of a preprocessing script.
+
+    For each output day, the manifest records the input files with their
+    size, modification time and hash, and the hashes of the configuration and
+    the code that produced the output. A day is up to date if none of these
+    has changed and its output files exist. An input file with a new
+    modification time but the same content does not count as changed.
+
+    A day may also carry script-specific information, and each input file
+    metadata (e.g., its time range) that stays valid as long as the size and
+    the modification time of the file are unchanged, so that the days to run
+    can be found without reading the files.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the manifest JSON file. A missing file is an empty manifest.
+    config_hash : str
+        Hash of the configuration that affects the outputs.
+    code_hash : str
+        Hash of the code that produces the outputs.
+
+    """
+
+    def __init__(self, filepath, config_hash, code_hash):
+        self.filepath = filepath
+        self.config_hash = config_hash
+        self.code_hash = code_hash
+        try:
+            with open(filepath, 'r') as f:
+                content = json.load(f)
+            self.days = content['days']
+            self.files = content.get('files', {})
+        except (IOError, OSError, ValueError, KeyError):
+            self.days = {}
+            self.files = {}
+
+    def recorded_inputs(self, day_key):
+        """Get the input files recorded for a day; None if not recorded."""
+        entry = self.days.get(day_key)
+        return None if entry is None else sorted(entry['inputs'])
+
+    def day_info(self, day_key):
+        """Get the information recorded for a day; None if not recorded."""
+        entry = self.days.get(day_key)
+        return None if entry is None else entry.get('info')
+
+    def file_info(self, filepath):
+        """
+        Get the metadata recorded for a file; None if not recorded, or if the
+        file has changed since.
+        """
+        record = self.files.get(filepath)
+        if record is None:
+            return None
+        signature = preproc_io.file_signature(filepath)
+        if signature['size'] != record['size'] or \
+                signature['mtime_ns'] != record['mtime_ns']:
+            return None
+        return record['info']
+
+    def record_file(self, filepath, info):
+        """Record the metadata of a file, along with its signature."""
+        self.files[filepath] = dict(preproc_io.file_signature(filepath),
+                                    info=info)
+
+    def is_up_to_date(self, day_key, input_files, output_files):
+        """Check if the output of a day is current with its inputs."""
+        entry = self.days.get(day_key)
+        if entry is None or entry['config'] != self.config_hash or \
+                entry['code'] != self.code_hash:
+            return False
+        if sorted(entry['inputs']) != sorted(input_files):
+            return False
+        if not all(os.path.isfile(f) for f in output_files):
+            return False
+        for filepath in input_files:
+            recorded = entry['inputs'][filepath]
+            signature = preproc_io.file_signature(filepath)
+            if signature['size'] != recorded['size']:
+                return False
+            if signature['mtime_ns'] != recorded['mtime_ns']:
+                if file_digest(filepath) != recorded['sha1']:
+                    return False
+                recorded.update(signature)  # touched, but not modified
+        return True
+
+    def discard(self, day_key):
+        """Forget a day, so that it is processed again."""
+        self.days.pop(day_key, None)
+
+    def update(self, day_key, input_files, info=None):
+        """
+        Record the inputs of a day after its output has been written, with
+        optional JSON-serializable information of the day.
+        """
+        self.days[day_key] = {
+            'inputs': {
+                filepath: dict(preproc_io.file_signature(filepath),
+                               sha1=file_digest(filepath))
+                for filepath in input_files},
+            'config': self.config_hash,
+            'code': self.code_hash,
+        }
+        if info is not None:
+            self.days[day_key]['info'] = info
+
+    def save(self):
+        """Write the manifest to its JSON file by atomic renaming."""
+        # metadata of the files that no longer exist are dropped
+        files = {filepath: record for filepath, record in self.files.items()
+                 if os.path.isfile(filepath)}
+        with open(self.filepath + '.tmp', 'w') as f:
+            json.dump({'days': self.days, 'files': files}, f, indent=1,
+                      sort_keys=True)
+        os.replace(self.filepath + '.tmp', self.filepath)
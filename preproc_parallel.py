@@ -0,0 +1,93 @@
+"""
+Parallel execution helpers shared by the preprocessing scripts.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+"""
+import collections
+import concurrent.futures
+
+
+def imap_bounded(pool, func, iterable, max_pending):
+    """
+    Map a function over argument tuples in a process pool, in order.
+
+    Unlike `multiprocessing.Pool.imap`, which consumes the whole iterable
+    ahead of the workers, at most `max_pending` tasks are submitted at a time,
+    so that the arguments of the tasks (e.g., data arrays read on the fly)
+    never pile up in memory.
+
+    Parameters
+    ----------
+    pool : multiprocessing.pool.Pool or None
+        Process pool. If None, the function is called in this process.
+    func : callable
+        Function to apply; must be picklable, i.e., defined at module level.
+    iterable : iterable of tuple
+        Argument tuples of the function calls.
+    max_pending : int
+        Maximum number of tasks submitted but not yet collected.
+
+    Return
+    ------
+    results : iterator
+        Results of the function calls, in the order of the arguments.
+
+    """
+    if pool is None:
+        for args in iterable:
+            yield func(*args)
+        return
+
+    pending = collections.deque()
+    for args in iterable:
+        pending.append(pool.apply_async(func, args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def imap_threads(func, iterable, max_workers, max_pending=None):
+    """
+    Map a function over items in a thread pool, in order.
+
+    Suited for I/O-bound functions, e.g., reading and parsing files, since
+    file I/O and much of the work of the pandas C parser release the GIL.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to each item.
+    iterable : iterable
+        Items to apply the function to.
+    max_workers : int
+        Number of worker threads. If 1 or less, the function is called in
+        this thread.
+    max_pending : int, optional
+        Maximum number of items submitted but not yet collected, to bound the
+        results held in memory ahead of the consumer. Default is twice the
+        number of worker threads.
+
+    Return
+    ------
+    results : iterator
+        Results of the function calls, in the order of the items.
+
+    """
+    if max_workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,122 @@
+"""
+Daily diagnostic plots, rendered in background worker processes.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+A plot layout is a dict with the keys
+
+| key       | value                                                        |
+|-----------|--------------------------------------------------------------|
+| 'name'    | name of the layout, to reuse its figure between days         |
+| 'figsize' | (optional) figure size in inches                             |
+| 'panels'  | list of panels, top to bottom, each a dict of 'columns'      |
+|           | (list of column names), 'ylabel', 'ncol' (legend columns)    |
+| 'xlabel'  | label of the x axis, shared by the panels                    |
+| 'xlim'    | range of the x axis                                          |
+| 'xticks'  | ticks of the x axis                                          |
+
+"""
+import collections
+import multiprocessing
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# figures and their lines of each layout in this process, reused between days
+_figures = {}
+
+
+def _get_figure(layout):
+    """Get the figure of a layout in this process, or create it."""
+    if layout['name'] in _figures:
+        return _figures[layout['name']]
+
+    fig = Figure(figsize=layout.get('figsize'))
+    FigureCanvasAgg(fig)  # Agg rendering, independent of the pyplot backend
+    axes = fig.subplots(len(layout['panels']), 1, sharex=True, squeeze=False)
+    lines = {}
+    for ax, panel in zip(axes[:, 0], layout['panels']):
+        for col in panel['columns']:
+            lines[col], = ax.plot([], [], label=col, lw=1.)
+        ax.legend(loc='upper left', frameon=False, fontsize=10,
+                  ncol=panel['ncol'])
+        ax.set_ylabel(panel['ylabel'])
+    axes[-1, 0].set_xlim(layout['xlim'])
+    axes[-1, 0].xaxis.set_ticks(layout['xticks'])
+    axes[-1, 0].set_xlabel(layout['xlabel'])
+    _figures[layout['name']] = fig, axes[:, 0], lines
+    return _figures[layout['name']]
+
+
+def render_daily_plot(layout, x, columns, filepath):
+    """
+    Render a daily plot with the figure of its layout, and save it.
+
+    The lines of the figure are updated in place with the data of the day,
+    instead of creating a new figure.
+
+    Parameters
+    ----------
+    layout : dict
+        Plot layout; see the module docstring.
+    x : array_like
+        Values of the x axis, e.g., time in hours.
+    columns : dict
+        Values of the columns in the layout, keyed by column names.
+    filepath : str
+        Path of the image file.
+
+    """
+    fig, axes, lines = _get_figure(layout)
+    for col, line in lines.items():
+        line.set_data(x, columns[col])
+    for ax in axes:
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+    fig.tight_layout()
+    fig.savefig(filepath)
+
+
+class PlotPool(object):
+    """
+    Pool of worker processes that render daily plots in the background.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+        Number of worker processes. If 0, the plots are rendered in this
+        process when submitted. Default is 1.
+    max_pending : int, optional
+        Maximum number of plots submitted but not yet rendered, to bound the
+        plot data held in memory. Default is 8 per worker.
+
+    """
+
+    def __init__(self, n_workers=1, max_pending=None):
+        if n_workers > 0:
+            # forked workers inherit the style settings of this process
+            self.pool = multiprocessing.get_context('fork').Pool(n_workers)
+        else:
+            self.pool = None
+        self.max_pending = max_pending or 8 * max(n_workers, 1)
+        self.pending = collections.deque()
+
+    def submit(self, layout, x, columns, filepath):
+        """Submit a daily plot; see `render_daily_plot` for the arguments."""
+        if self.pool is None:
+            render_daily_plot(layout, x, columns, filepath)
+            return
+        self.pending.append(self.pool.apply_async(
+            render_daily_plot, (layout, np.asarray(x), columns, filepath)))
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().get()
+
+    def close(self):
+        """Wait for all submitted plots, and stop the workers."""
+        while self.pending:
+            self.pending.popleft().get()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
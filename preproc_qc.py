@@ -0,0 +1,330 @@
+"""
+Quality control rules of the raw data, applied as vectorized masks.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+Each rule is a dict with the keys
+
+| key         | value                                                      |
+|-------------|------------------------------------------------------------|
+| 'columns'   | list of the data columns the rule applies to               |
+| 'start'     | `datetime.datetime` the rule starts, or None for unbounded |
+| 'end'       | `datetime.datetime` the rule ends, or None for unbounded   |
+| 'closed'    | (optional) closed ends of the interval: 'left', 'right',   |
+|             | 'both', or 'neither' (default)                             |
+| 'condition' | (optional) value condition `(operator, threshold)`, e.g.,  |
+|             | `('<', 0.6)`; only the values meeting it are affected      |
+| 'action'    | (optional) 'mask' (default): set the values to NaN         |
+
+To add an outage, append a rule to the table; the processing scripts need no
+change.
+
+"""
+import datetime
+import warnings
+import collections
+import numpy as np
+
+
+_comparison_funcs = {'<': np.less, '<=': np.less_equal,
+                     '>': np.greater, '>=': np.greater_equal}
+
+
+# leaf and soil chamber sensor data
+sensor_qc_rules = [
+    # 1. 'T_ch_3' data between April 8 and 13 of 2016 were corrupt; TC in the
+    # large leaf chamber reinstalled 13 April 2016 11:20 am
+    {'columns': ['T_ch_3'],
+     'start': datetime.datetime(2016, 4, 8, 9, 33, 41),
+     'end': datetime.datetime(2016, 4, 13, 11, 20, 24)},
+    # 2. no soil chamber sensors before 12 April 2016 10:37:09 am
+    {'columns': ['T_ch_4', 'T_ch_5', 'T_ch_6'],
+     'start': None,
+     'end': datetime.datetime(2016, 4, 12, 10, 37, 9)},
+    # 3. remove 'PAR_ch_2' data before before 8 April 2016 09:40:25 am
+    {'columns': ['PAR_ch_2'],
+     'start': None,
+     'end': datetime.datetime(2016, 4, 8, 9, 40, 25)},
+    # 4. 'PAR_ch_2' data from 08:40 to 09:41 on 7 June 2016 were corrupt
+    {'columns': ['PAR_ch_1', 'PAR_ch_2'],
+     'start': datetime.datetime(2016, 6, 7, 8, 40),
+     'end': datetime.datetime(2016, 6, 7, 9, 41),
+     'condition': ('<', 400.)},
+    # 5. power failure for leaf chamber sensor logger
+    # no data from 30 Aug 2016 13:44:36 to 5 Sep 2016 11:22:44
+    {'columns': ['PAR_ch_1', 'PAR_ch_2', 'T_amb', 'T_ch_1', 'T_ch_2',
+                 'T_ch_3'],
+     'start': datetime.datetime(2016, 8, 30, 13, 44, 36),
+     'end': datetime.datetime(2016, 9, 5, 11, 22, 44)},
+    # 6. thermocouple at channel 11 (T_ch_2) was fallen during
+    # 29 Aug 2016 09:00 to 12 Sep 2016 11:00; masked from the start of the day
+    {'columns': ['T_ch_2'],
+     'start': datetime.datetime(2016, 8, 29),
+     'end': datetime.datetime(2016, 9, 12, 11, 0, 0),
+     'closed': 'left'},
+    # 7. Bad PAR measurements from 10:30 to 11:00 on 5 Oct 2016 (?)
+    # no action, since no abnormal measurements were detected in this period
+    # 8. allow -5 as the lower limit of PAR (tolerance for random errors)
+    {'columns': ['PAR_ch_1', 'PAR_ch_2'],
+     'start': None,
+     'end': None,
+     'condition': ('<', -5.)},
+]
+
+# flow data
+flow_qc_rules = [
+    # seriously negative flow rates on Aug 27 due to power failure; otherwise,
+    # the interpolation between Aug 27 and 29 would be wrong. Note: the
+    # transient spikes in flow rates, e.g., on Aug 12 & 15, may be real.
+    {'columns': ['flow_ch_1', 'flow_ch_2', 'flow_ch_3'],
+     'start': datetime.datetime(2016, 8, 27),
+     'end': datetime.datetime(2016, 8, 28),
+     'closed': 'left',
+     'condition': ('<', 0.6)},
+    {'columns': ['flow_ch_4', 'flow_ch_5'],
+     'start': datetime.datetime(2016, 8, 27),
+     'end': datetime.datetime(2016, 8, 28),
+     'closed': 'left',
+     'condition': ('<', 1.)},
+]
+
+
+class QCRuleTable(object):
+    """
+    Quality control rules compiled into sorted, disjoint time intervals.
+
+    The rules of each column with the same value condition are merged into
+    half-open intervals `[lo, hi)` in day of year values, so that applying
+    them takes one `numpy.searchsorted` per column and condition, over any
+    time range, e.g., a batch of several days.
+
+    Parameters
+    ----------
+    rules : list of dict
+        Rules of the table; see the module docstring for the keys.
+    year : int, optional
+        Year of the day of year values. Default is 2016.
+
+    """
+
+    def __init__(self, rules, year=2016):
+        self.year = year
+        self.intervals = {}
+        grouped = {}
+        for rule in rules:
+            action = rule.get('action', 'mask')
+            if action != 'mask':
+                raise ValueError('Unknown QC rule action: %s' % action)
+            condition = rule.get('condition')
+            if condition is not None and \
+                    condition[0] not in _comparison_funcs:
+                raise ValueError('Unknown QC rule operator: %s' %
+                                 condition[0])
+            closed = rule.get('closed', 'neither')
+            if closed not in ('left', 'right', 'both', 'neither'):
+                raise ValueError('Unknown QC rule interval closure: %s' %
+                                 closed)
+            lo = self._to_doy(rule['start'], -np.inf)
+            hi = self._to_doy(rule['end'], np.inf)
+            # convert to half-open intervals, exactly in floating point
+            if closed not in ('left', 'both'):
+                lo = np.nextafter(lo, np.inf)
+            if closed in ('right', 'both'):
+                hi = np.nextafter(hi, np.inf)
+            for col in rule['columns']:
+                grouped.setdefault((col, condition), []).append((lo, hi))
+
+        for (col, condition), bounds in grouped.items():
+            bounds.sort()
+            merged = [list(bounds[0])]
+            for lo, hi in bounds[1:]:
+                if lo <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], hi)
+                else:
+                    merged.append([lo, hi])
+            merged = np.array(merged, dtype=np.float64)
+            self.intervals.setdefault(col, []).append(
+                (condition, merged[:, 0], merged[:, 1]))
+
+    def _to_doy(self, dt, default):
+        """Convert a datetime to day of year, the same way as the data."""
+        if dt is None:
+            return default
+        return (dt - datetime.datetime(self.year, 1, 1)).total_seconds() / \
+            86400.
+
+    def mask(self, doy, col):
+        """
+        Get the mask of a column by the time intervals, ignoring conditions.
+
+        Return
+        ------
+        masks : list of tuple
+            `(condition, mask)` pairs, one for each condition of the column.
+
+        """
+        doy = np.asarray(doy, dtype=np.float64)
+        masks = []
+        for condition, lo, hi in self.intervals.get(col, []):
+            loc = np.searchsorted(lo, doy, side='right') - 1
+            in_interval = (loc >= 0) & (doy < hi[np.maximum(loc, 0)])
+            masks.append((condition, in_interval))
+        return masks
+
+    def apply(self, doy, data, columns=None):
+        """
+        Apply the rules to a data table, in place.
+
+        Parameters
+        ----------
+        doy : array_like
+            Day of year values of the rows. NaN is never masked.
+        data : pandas.DataFrame or array_like
+            Data table, or a 2D float array.
+        columns : list of str, optional
+            Column names of a 2D array. Not needed for a DataFrame.
+
+        """
+        if columns is None:
+            columns = list(data.columns)
+        for col_num, col in enumerate(columns):
+            if col not in self.intervals:
+                continue
+            is_frame = hasattr(data, 'loc')
+            values = data[col].values if is_frame else data[:, col_num]
+            for condition, in_interval in self.mask(doy, col):
+                if condition is not None:
+                    with np.errstate(invalid='ignore'):
+                        in_interval &= _comparison_funcs[condition[0]](
+                            values, condition[1])
+                if not np.any(in_interval):
+                    continue
+                if is_frame:
+                    data.loc[in_interval, col] = np.nan
+                    values = data[col].values
+                else:
+                    data[in_interval, col_num] = np.nan
+
+
+class StreamingIQRFilter(object):
+    """
+    Streaming IQR filter of several channels over a trailing time window.
+
+    Each chunk of data, as it arrives, is summarized by a sketch of the
+    quantiles of each channel at `n_levels` evenly spaced levels, and its
+    number of finite values. The quartiles are estimated from the weighted
+    sketches of the chunks in the trailing window, without keeping or
+    rescanning the data. All channels are handled at once.
+
+    With a single chunk in the window, the bounds are the same as those from
+    `numpy.nanpercentile` over the chunk. Otherwise, the quartiles are
+    accurate to about one sketch level (1 / `n_levels`) in rank.
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels.
+    window : float
+        Length of the trailing window, in days. Must be positive.
+    lower_factor, upper_factor : float, optional
+        Bounds are `Q1 - lower_factor * IQR` and `Q3 + upper_factor * IQR`.
+        Defaults are 2 and 5.
+    n_levels : int, optional
+        Number of quantile levels of the sketches. Must be `4 * k + 2` for
+        the quartiles to fall on sketch levels. Default is 102.
+
+    """
+
+    def __init__(self, n_channels, window, lower_factor=2., upper_factor=5.,
+                 n_levels=102):
+        if not window > 0:
+            raise ValueError('The window must be positive, got %r' % window)
+        self.n_channels = n_channels
+        self.window = window
+        self.lower_factor = lower_factor
+        self.upper_factor = upper_factor
+        # levels at the midpoints of `n_levels` equal ranks
+        self.levels = (np.arange(n_levels) + 0.5) / n_levels * 100.
+        self.sketches = collections.deque()
+
+    def update(self, doy, values):
+        """Add a chunk of data, `values` of shape (n_samples, n_channels)."""
+        values = np.asarray(values, dtype=np.float64).reshape(
+            -1, self.n_channels)
+        doy = np.asarray(doy, dtype=np.float64)
+        if not np.any(np.isfinite(doy)):
+            return
+        counts = np.sum(np.isfinite(values), axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN channels
+            quantiles = np.nanpercentile(values, self.levels, axis=0)
+        doy_latest = np.nanmax(doy)
+        self.sketches.append((doy_latest, quantiles, counts))
+        while self.sketches and \
+                self.sketches[0][0] <= doy_latest - self.window:
+            self.sketches.popleft()
+
+    def bounds(self):
+        """
+        Get the lower and upper bounds of the channels in the window.
+
+        Return
+        ------
+        lolim, uplim : array_like
+            Bounds of each channel; NaN for channels without finite values.
+
+        """
+        if len(self.sketches) == 0:
+            return (np.full(self.n_channels, np.nan),
+                    np.full(self.n_channels, np.nan))
+        points = np.concatenate([q for _, q, _ in self.sketches])
+        # each point of a sketch stands for 1 / n_levels of the values of its
+        # chunk; weights are scaled by n_levels, to be exact in floating point
+        weights = np.concatenate([
+            np.broadcast_to(counts, q.shape) for _, q, counts in
+            self.sketches]).astype(np.float64)
+        weights[~np.isfinite(points)] = 0.  # NaN points are sorted last
+        order = np.argsort(points, axis=0, kind='mergesort')
+        points = np.take_along_axis(points, order, axis=0)
+        weights = np.take_along_axis(weights, order, axis=0)
+        # cumulative weights at the midpoints of the points
+        cum_weights = np.cumsum(weights, axis=0) - 0.5 * weights
+        total = np.sum(weights, axis=0)
+
+        def weighted_quantile(fraction):
+            # linear interpolation between the points around the target rank
+            target = fraction * total
+            loc = np.clip(np.sum(cum_weights <= target, axis=0) - 1,
+                          0, points.shape[0] - 2)[np.newaxis, :]
+            x0, x1 = [np.take_along_axis(points, i, axis=0)[0]
+                      for i in (loc, loc + 1)]
+            c0, c1 = [np.take_along_axis(cum_weights, i, axis=0)[0]
+                      for i in (loc, loc + 1)]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                frac = np.clip((target - c0) / (c1 - c0), 0., 1.)
+            return np.where(frac > 0., x0 + frac * (x1 - x0), x0)
+
+        q1 = weighted_quantile(0.25)
+        q3 = weighted_quantile(0.75)
+        q1[total == 0] = np.nan
+        q3[total == 0] = np.nan
+        iqr = q3 - q1
+        return q1 - self.lower_factor * iqr, q3 + self.upper_factor * iqr
+
+    def filter(self, doy, values):
+        """
+        Add a chunk of data and mask its outliers, in place.
+
+        Parameters
+        ----------
+        doy : array_like
+            Day of year values of the samples.
+        values : array_like
+            Float array of shape (n_samples, n_channels), modified in place.
+
+        """
+        self.update(doy, values)
+        lolim, uplim = self.bounds()
+        with np.errstate(invalid='ignore'):
+            values[(values < lolim) | (values > uplim)] = np.nan
@@ -0,0 +1,574 @@
+"""
+Requests to the SMEAR data API, shared by the met data fetching script.
+For pre-processing only, not intended for general-purpose use.
+
+Hyytiälä COS campaign, April-November 2016
+
+"""
+import io
+import os
+import json
+import time
+import hashlib
+import datetime
+import tempfile
+import contextlib
+import urllib.parse
+import urllib3
+import requests
+import pandas as pd
+import preproc_io
+import preproc_parallel
+
+
+smear_url = 'http://avaa.tdata.fi/palvelut/smeardata.jsp'
+
+timestamp_cols = ['year', 'month', 'day', 'hour', 'minute', 'second']
+
+
+def build_url(base_url, variables, start_dt, end_dt, avg_type,
+              table='HYY_META'):
+    """
+    Build the URL of a SMEAR API query.
+
+    Parameters
+    ----------
+    base_url : str
+        URL of `smeardata.jsp`.
+    variables : list of str
+        Variable names in the table.
+    start_dt, end_dt : str
+        Time range, 'YYYY-mm-dd HH:MM:SS'.
+    avg_type : str
+        Type of the 30-min averaging: 'ARITHMETIC' or 'SUM'.
+    table : str, optional
+        Name of the table. Default is 'HYY_META'.
+
+    Return
+    ------
+    url : str
+        URL of the query.
+
+    """
+    return base_url + '?variables=' + ','.join(variables) + ',&table=' + \
+        table + '&from=' + start_dt + '&to=' + end_dt + \
+        '&quality=ANY&averaging=30MIN&type=' + avg_type
+
+
+def parse_timestamp_columns(df):
+    """
+    Combine the year to second columns of the fetched data into timestamps.
+
+    The six columns are replaced with a 'timestamp' column in place.
+    """
+    df.insert(0, 'timestamp', preproc_io.combine_timestamp_columns(
+        *[df[col].values for col in timestamp_cols]))
+    df.drop(timestamp_cols, axis=1, inplace=True)
+
+
+def new_session(max_connections=1):
+    """Make an HTTP session that keeps up to `max_connections` alive."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=max_connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def normalize_url(url):
+    """
+    Normalize the URL of a query, for use as a cache key.
+
+    The query parameters are sorted by name, but the values are kept as is,
+    since the order of the variables sets the order of the columns.
+    """
+    parts = urllib.parse.urlsplit(url)
+    params = sorted(urllib.parse.parse_qsl(parts.query,
+                                           keep_blank_values=True),
+                    key=lambda param: param[0])
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower(), parts.netloc.lower(), parts.path,
+        urllib.parse.urlencode(params, safe=',:'), ''))
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of the responses of SMEAR API queries.
+
+    A response is saved as a file named by the hash of the normalized URL of
+    its query. Responses of historical queries, which end more than a day
+    before now, do not change and never expire. Responses of queries that
+    reach closer to now expire after `ttl_hours`, since their latest data
+    may still be completed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cached responses.
+    ttl_hours : float, optional
+        Lifetime of the responses of recent queries, in hours. Default is 1.
+
+    """
+
+    def __init__(self, cache_dir, ttl_hours=1.):
+        self.cache_dir = cache_dir
+        self.ttl = ttl_hours * 3600.
+
+    def path(self, url):
+        """Path of the cached response of a query."""
+        key = hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.csv')
+
+    def is_historical(self, url):
+        """Check if a query ends more than a day before now (UTC+2)."""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        dt_final = (datetime.datetime.utcnow() + datetime.timedelta(hours=2) -
+                    datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        return 'to' in query and query['to'][0] <= dt_final
+
+    def get(self, url, allow_expired=False):
+        """
+        Get the cached response of a query.
+
+        Parameters
+        ----------
+        url : str
+            URL of the query.
+        allow_expired : bool, optional
+            Also return an expired response, e.g., when the API cannot be
+            reached. Default is False.
+
+        Return
+        ------
+        content : bytes or None
+            Body of the response; None if not cached, or expired.
+
+        """
+        filepath = self.path(url)
+        try:
+            age = time.time() - os.path.getmtime(filepath)
+            if not allow_expired and age > self.ttl and \
+                    not self.is_historical(url):
+                return None
+            with open(filepath, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @contextlib.contextmanager
+    def writer(self, url):
+        """
+        Open a binary file to save the response of a query.
+
+        The response is cached when the `with` block exits normally, and
+        discarded if it raises, e.g., on a broken download.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, self.path(url))
+
+
+class _TeeReader(io.RawIOBase):
+    """Binary stream that copies the bytes read from a stream to a file."""
+
+    def __init__(self, stream, sink):
+        self.stream = stream
+        self.sink = sink
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[0:len(data)] = data
+        self.sink.write(data)
+        return len(data)
+
+
+def _read_table(stream, variables):
+    """Read the body of a response from a binary stream as a table."""
+    df = pd.read_csv(stream, sep=',', header=0,
+                     names=timestamp_cols + list(variables),
+                     engine='c', encoding='utf-8')
+    parse_timestamp_columns(df)
+    return df
+
+
+def fetch_table(session, url, variables, cache=None):
+    """
+    Fetch the data of a query as a table.
+
+    Parameters
+    ----------
+    session : requests.Session
+        HTTP session, to reuse connections.
+    url : str
+        URL of the query.
+    variables : list of str
+        Variable names of the query, in order.
+    cache : ResponseCache, optional
+        Cache of the responses. A cached response is used instead of a
+        request, and an expired one if the request fails or its status is
+        not 200. Default is None.
+
+    Return
+    ------
+    df : pandas.DataFrame or None
+        Table of the columns 'timestamp' and the variables; None if the
+        request fails.
+    message : str
+        Status of the request, for printing.
+
+    """
+    if cache is not None:
+        content = cache.get(url)
+        if content is not None:
+            return _read_table(io.BytesIO(content), variables), \
+                'Loaded from cache.'
+    # the body is parsed as it is downloaded, from the raw bytes; it is never
+    # held in memory as a whole
+    try:
+        with session.get(url, verify=True, stream=True) as response:
+            # set `verify=True` to check SSL certificate
+            if response.status_code == 200:
+                response.raw.decode_content = True  # e.g., gzip encoded
+                if cache is None:
+                    return _read_table(response.raw, variables), \
+                        'Successful!'
+                with cache.writer(url) as sink:
+                    df = _read_table(io.BufferedReader(
+                        _TeeReader(response.raw, sink)), variables)
+                return df, 'Successful!'
+            status = 'Status %d' % response.status_code
+            reason = 'No response from the request.'
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as err:
+        status, reason = 'Request failed', err
+    # an expired response stands in for a failed request
+    content = cache.get(url, allow_expired=True) \
+        if cache is not None else None
+    if content is not None:
+        return _read_table(io.BytesIO(content), variables), \
+            '%s; loaded from expired cache.' % status
+    return None, '%s: %s' % (status, reason)
+
+
+def time_windows(start_dt, end_dt, window_days=None):
+    """
+    Split a time range into consecutive windows.
+
+    Parameters
+    ----------
+    start_dt, end_dt : str
+        Time range, 'YYYY-mm-dd HH:MM:SS'.
+    window_days : float, optional
+        Length of the windows in days. If None, the range is one window.
+
+    Return
+    ------
+    windows : list of tuple
+        `(start_dt, end_dt)` of the windows, in time order.
+
+    """
+    if window_days is None:
+        return [(start_dt, end_dt)]
+    dt_fmt = '%Y-%m-%d %H:%M:%S'
+    start = datetime.datetime.strptime(start_dt, dt_fmt)
+    end = datetime.datetime.strptime(end_dt, dt_fmt)
+    step = datetime.timedelta(days=window_days)
+    windows = []
+    while start < end:
+        windows.append((start.strftime(dt_fmt),
+                        min(start + step, end).strftime(dt_fmt)))
+        start += step
+    return windows
+
+
+def plan_requests(variables, avg_types, start_dt, end_dt, target_values,
+                  window_days=None):
+    """
+    Plan the queries of variables, batched by their expected payload.
+
+    The variables are grouped by averaging type, since a query has only one.
+    Each group is split into batches of about equal size, each of at most
+    `target_values` values (rows x columns) per time window, or of one
+    variable if a single variable exceeds it. The more rows per window, the
+    fewer variables per query.
+
+    Parameters
+    ----------
+    variables : list of str
+        Variable names.
+    avg_types : list of str
+        Averaging types of the variables; see `build_url`.
+    start_dt, end_dt : str
+        Time range, 'YYYY-mm-dd HH:MM:SS'.
+    target_values : int
+        Target number of values in the response of a query.
+    window_days : float, optional
+        Length of the time windows in days; see `time_windows`. Default is
+        None, for a single window.
+
+    Return
+    ------
+    requests_list : list of tuple
+        Queries as `(variables, avg_type)` pairs. The groups are in the order
+        of their first variable, and the variables keep their order.
+
+    """
+    window_start, window_end = time_windows(start_dt, end_dt, window_days)[0]
+    # 30-min time steps in the (first) window
+    n_rows = max((pd.Timestamp(window_end) - pd.Timestamp(window_start)) //
+                 pd.Timedelta(minutes=30), 1)
+    batch_size = max(target_values // n_rows, 1)
+
+    groups = {}
+    for var, avg_type in zip(variables, avg_types):
+        groups.setdefault(avg_type, []).append(var)
+    requests_list = []
+    for avg_type in sorted(groups, key=lambda t: avg_types.index(t)):
+        group = groups[avg_type]
+        n_batches = -(-len(group) // batch_size)
+        for i in range(n_batches):
+            requests_list.append((
+                group[i * len(group) // n_batches:
+                      (i + 1) * len(group) // n_batches], avg_type))
+    return requests_list
+
+
+def _chunk_path(chunk_dir, base_url, requests_list, window):
+    """Path of the persisted table of a window."""
+    key = hashlib.sha1(json.dumps(
+        [base_url, [[list(v), t] for v, t in requests_list], list(window)],
+        sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(chunk_dir, '%s_%s_%s.csv' % (
+        window[0][0:10], window[1][0:10], key[0:12]))
+
+
+def _merge_tables(tables, variables):
+    """Merge the tables of the queries of a window on the timestamps."""
+    if len(tables) == 0:
+        df = pd.DataFrame(columns=variables,
+                          index=pd.DatetimeIndex([], name='timestamp'))
+    else:
+        df = pd.concat(tables, axis=1, join='outer').sort_index()
+    df = df.reindex(columns=variables)
+    df.index.name = 'timestamp'
+    return df
+
+
+def fetch_concurrently(requests_list, start_dt, end_dt, max_workers,
+                       base_url=smear_url, print_status=True,
+                       window_days=None, chunk_dir=None, cache=None):
+    """
+    Fetch several queries of the same time range concurrently, and merge
+    them on the timestamp column.
+
+    The time range may be split into windows, e.g., weekly, which are
+    fetched concurrently as well, so that a failed request loses only one
+    window of one query. All requests share a keep-alive session, with at
+    most `max_workers` requests in flight at a time.
+
+    If `chunk_dir` is given, the table of each window is saved there as soon
+    as all of its queries succeed, and is loaded instead of fetched in later
+    runs, so that an interrupted run resumes from the missing windows.
+    Windows that end less than a day before now are not saved, since their
+    data may still be completed. The responses of the single queries may be
+    cached as well; see `ResponseCache`.
+
+    Parameters
+    ----------
+    requests_list : list of tuple
+        Queries as `(variables, avg_type)` pairs; see `build_url`.
+    start_dt, end_dt : str
+        Time range, 'YYYY-mm-dd HH:MM:SS'.
+    max_workers : int
+        Maximum number of concurrent requests.
+    base_url : str, optional
+        URL of `smeardata.jsp`. Default is the SMEAR API.
+    print_status : bool, optional
+        Print the status of each window and failed request, in time order.
+        Default is True.
+    window_days : float, optional
+        Length of the windows in days. Default is None, for a single window.
+    chunk_dir : str, optional
+        Directory to save the tables of the windows. Default is None.
+    cache : ResponseCache, optional
+        Cache of the responses of the queries. Default is None.
+
+    Return
+    ------
+    df : pandas.DataFrame
+        Table of the column 'timestamp' and the variables of all queries, in
+        the order of the queries, sorted by timestamp. Variables of failed
+        requests are NaN.
+    n_failed : int
+        Number of failed requests, over all windows.
+
+    """
+    all_variables = [var for variables, _ in requests_list
+                     for var in variables]
+    windows = time_windows(start_dt, end_dt, window_days)
+    # local time is UTC+2
+    dt_final = (datetime.datetime.utcnow() + datetime.timedelta(hours=2) -
+                datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+    # load the saved windows, and list the requests of the others
+    window_tables = [None] * len(windows)
+    tasks = []
+    for i, window in enumerate(windows):
+        if chunk_dir is not None:
+            chunk_path = _chunk_path(chunk_dir, base_url, requests_list,
+                                     window)
+            if os.path.isfile(chunk_path):
+                window_tables[i] = pd.read_csv(
+                    chunk_path, index_col='timestamp', parse_dates=True,
+                    float_precision='round_trip')
+                continue
+        tasks.extend((i, query) for query in requests_list)
+    if print_status and chunk_dir is not None:
+        print('%d of %d time window(s) loaded from saved chunks.' %
+              (len(windows) - len(tasks) // max(len(requests_list), 1),
+               len(windows)))
+
+    session = new_session(max_workers)
+
+    def fetch(task):
+        i, (variables, avg_type) = task
+        return fetch_table(session, build_url(
+            base_url, variables, windows[i][0], windows[i][1], avg_type),
+            variables, cache)
+
+    # tasks are in time order, so the windows are completed one by one
+    results = preproc_parallel.imap_threads(fetch, tasks, max_workers)
+    pending_tables, n_failed, n_failed_total = [], 0, 0
+    for n_done, ((i, (variables, _)), (df, message)) in enumerate(
+            zip(tasks, results), 1):
+        if df is not None:
+            pending_tables.append(df.set_index('timestamp'))
+        else:
+            n_failed += 1
+            if print_status:
+                print("Fetching variable(s) '%s' from %s to %s ... %s" %
+                      (', '.join(variables), windows[i][0], windows[i][1],
+                       message))
+        if n_done % len(requests_list) != 0:
+            continue
+        # all queries of the window are done
+        window_tables[i] = _merge_tables(pending_tables, all_variables)
+        if print_status:
+            print('Fetched from %s to %s: %d request(s), %d failed.' %
+                  (windows[i][0], windows[i][1], len(requests_list),
+                   n_failed))
+        if chunk_dir is not None and n_failed == 0 and \
+                windows[i][1] <= dt_final:
+            os.makedirs(chunk_dir, exist_ok=True)
+            chunk_path = _chunk_path(chunk_dir, base_url, requests_list,
+                                     windows[i])
+            window_tables[i].to_csv(chunk_path + '.tmp')
+            os.replace(chunk_path + '.tmp', chunk_path)
+        n_failed_total += n_failed
+        pending_tables, n_failed = [], 0
+    session.close()
+
+    df_merged = pd.concat(window_tables)
+    # windows may share a boundary time step
+    df_merged = df_merged[~df_merged.index.duplicated(keep='first')]
+    df_merged.index.name = 'timestamp'
+    return df_merged.reset_index(), n_failed_total
+
+
+def _scan_rows_backwards(filepath, block_size=1 << 16):
+    """
+    Iterate over the rows of a CSV table backwards, from the end of the file.
+
+    Yield
+    -----
+    offset : int
+        Byte offset of the start of the row.
+    line : bytes
+        The row, without the line ending. The header is not yielded.
+
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        remainder = b''
+        while end > 0:
+            start = max(end - block_size, 0)
+            f.seek(start)
+            block = f.read(end - start) + remainder
+            lines = block.split(b'\n')
+            # the first piece may be incomplete, unless at the file start
+            remainder = lines.pop(0) if start > 0 else b''
+            offset = start + len(remainder) + (1 if start > 0 else 0)
+            offsets = []
+            for line in lines:
+                offsets.append(offset)
+                offset += len(line) + 1
+            for offset, line in zip(reversed(offsets), reversed(lines)):
+                if offset == 0:
+                    return  # the header
+                if line.strip():
+                    yield offset, line.rstrip(b'\r')
+            end = start
+
+
+def last_timestamp(filepath):
+    """
+    Get the last timestamp in a table written by the fetching script, by
+    reading only the end of the file.
+
+    Return
+    ------
+    timestamp : str or None
+        Timestamp of the last row, 'YYYY-mm-dd HH:MM:SS'; None if the table
+        has no rows.
+
+    """
+    for _, line in _scan_rows_backwards(filepath):
+        return line.split(b',', 1)[0].decode('utf-8')
+    return None
+
+
+def rows_offset(filepath, start_dt):
+    """
+    Find the byte offset of the first row at or after a time in a table
+    written by the fetching script, by reading only the end of the file.
+
+    The timestamps in the first column are compared as strings, which works
+    for the time-ordered 'YYYY-mm-dd HH:MM:SS' format.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the table.
+    start_dt : str
+        Time, 'YYYY-mm-dd HH:MM:SS'.
+
+    Return
+    ------
+    offset : int
+        Byte offset of the row; the size of the file if all rows are before
+        the time.
+
+    """
+    offset = os.path.getsize(filepath)
+    start_dt = start_dt.encode('utf-8')
+    for row_offset, line in _scan_rows_backwards(filepath):
+        if line.split(b',', 1)[0] < start_dt:
+            break
+        offset = row_offset
+    return offset
+
+
+def read_header(filepath):
+    """Get the column names of a CSV table from its first line."""
+    with open(filepath, 'r') as f:
+        return f.readline().rstrip('\r\n').split(',')